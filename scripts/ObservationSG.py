@@ -1,8 +1,11 @@
 import os
-import sys
+import csv
 import time
+import struct
 import requests
-import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from supabase import create_client, Client
@@ -13,9 +16,24 @@ SUPABASE_URL = os.getenv("SUPABASE_URL")
 SUPABASE_KEY = os.getenv("SUPABASE_SERVICE_ROLE_KEY")
 supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
 
+# eBird API 用の共有セッション（接続を使い回す）
+SESSION = requests.Session()
+SESSION.headers.update({"X-eBirdApiToken": API_KEY})
+# 429 / 5xx のときだけバックオフして再試行する（Retry-After ヘッダーも尊重）
+RETRY = Retry(total=5, backoff_factor=0.5, status_forcelist=[429, 500, 502, 503, 504], allowed_methods=["GET"])
+SESSION.mount("https://", HTTPAdapter(pool_connections=20, pool_maxsize=20, max_retries=RETRY))
+
+# 翌日分の eBird データを先読みするワーカー（取得と DB 書き込みを重ねる）
+PREFETCHER = ThreadPoolExecutor(max_workers=1)
+
 # taxonomy.csv
 csv_path = os.path.join(os.path.dirname(__file__), "..", "data", "eBird_taxonomy_v2024.csv")
-taxonomy_df = pd.read_csv(csv_path)
+# species_code -> (PRIMARY_COM_NAME, SCI_NAME) の索引
+with open(csv_path, encoding="utf-8") as f:
+    TAX_MAP = {r["SPECIES_CODE"]: (r["PRIMARY_COM_NAME"], r["SCI_NAME"]) for r in csv.DictReader(f)}
+
+# SGBird の species_code（初回の run_sync で一括取得し、再実行でも使い回す）
+known_codes = None
 
 # 再開ファイル
 progress_path = os.path.join(os.path.dirname(__file__), "..", "last_successful_date.txt")
@@ -29,107 +47,159 @@ def save_progress(date):
     with open(progress_path, "w") as f:
         f.write(date.strftime("%Y-%m-%d"))
 
+def to_float4(x):
+    """lat/lng を DB の real (float4) 精度に丸める（観測キーの照合用）"""
+    return struct.unpack("f", struct.pack("f", x))[0]
+
+def row_key(r):
+    """ObservationSG の行を (obs_dt, lat, lng) の観測キーにする"""
+    return (r["obs_dt"], to_float4(r["lat"]), to_float4(r["lng"]))
+
+def fetch_existing_observations(date_str, page_size=1000):
+    """指定日の ObservationSG を (obs_dt, lat, lng) -> id の dict で返す"""
+    existing_map = {}
+    start = 0
+    while True:
+        page = supabase.table("ObservationSG").select("id,obs_dt,lat,lng").eq("obs_dt", date_str).range(start, start + page_size - 1).execute().data
+        for r in page:
+            existing_map[row_key(r)] = r["id"]
+        if len(page) < page_size:
+            return existing_map
+        start += page_size
+
+def insert_new_observations(new_obs, existing_map):
+    """新規観測をまとめて insert し、返ってきた id を existing_map に登録する"""
+    res = supabase.table("ObservationSG").insert(list(new_obs.values())).execute()
+    # 返却行の並び順には頼らず、fetch_existing_observations と同じキーで登録する
+    for r in res.data:
+        existing_map[row_key(r)] = r["id"]
+    new_obs.clear()
+
+def insert_bird_batch(bird_batch, existing_map):
+    """観測キーを id に解決して ObservationSGBird をまとめて insert する"""
+    supabase.table("ObservationSGBird").insert([
+        {
+            "observation_id": existing_map[obs_key],
+            "species_code": sp_code,
+            "how_many": how_many
+        }
+        for obs_key, sp_code, how_many in bird_batch
+    ]).execute()
+
+def fetch_day(region, day):
+    """指定日の eBird 観測データを取得する"""
+    url = f"https://api.ebird.org/v2/data/obs/{region}/historic/{day.year}/{day.month}/{day.day}"
+    r = SESSION.get(url)
+    r.raise_for_status()
+    return r
+
 # ---------------- メイン処理 ---------------- #
 def run_sync():
+    global known_codes
     REGION = "SG"
     START_DATE = get_start_date()
     END_DATE = datetime.now()
     RATE_SLEEP = 0.5
-    BATCH_SIZE = 100
-    INSERT_PAUSE = 0.1
+    RATE_LIMIT_FLOOR = 5
+    BATCH_SIZE = 2000
 
     current = START_DATE
     total_inserted = 0
 
+    # SGBird の species_code を一括取得（観測ごとの問い合わせを避ける）
+    if known_codes is None:
+        known_codes = {r["species_code"] for r in supabase.table("SGBird").select("species_code").execute().data}
+
     print(f"🚀 Starting eBird sync from {current.date()} to {END_DATE.date()}")
 
+    next_fetch = PREFETCHER.submit(fetch_day, REGION, current)
+
     while current <= END_DATE:
         date_str = current.strftime("%Y-%m-%d")
         print(f"\n📅 Fetching data for {date_str}...")
-        url = f"https://api.ebird.org/v2/data/obs/{REGION}/historic/{current.year}/{current.month}/{current.day}"
 
         try:
-            r = requests.get(url, headers={"X-eBirdApiToken": API_KEY})
-            r.raise_for_status()
+            r = next_fetch.result()
             rows = r.json()
         except Exception as e:
             print(f"🔴 Error fetching {date_str}: {e}")
             raise  # ここで例外を上げて再実行へ
 
+        # 当日分を書き込んでいる間に翌日分を取得しておく
+        next_day = current + timedelta(days=1)
+        if next_day <= END_DATE:
+            next_fetch = PREFETCHER.submit(fetch_day, REGION, next_day)
+
         day_inserted = 0
         batch_count = 0
         bird_batch = []
+        new_obs = {}
+        existing_map = fetch_existing_observations(date_str)
 
         for obs in rows:
-            sp_code = obs.get("speciesCode")
-            obs_dt_raw = obs.get("obsDt")
-            lat = obs.get("lat")
-            lng = obs.get("lng")
+            g = obs.get
+            sp_code = g("speciesCode")
+            obs_dt_raw = g("obsDt")
+            lat = g("lat")
+            lng = g("lng")
 
             if not (sp_code and obs_dt_raw and lat and lng):
                 continue
 
             # Check if species_code exists
-            species_lookup = supabase.table("SGBird").select("species_code").eq("species_code", sp_code).execute()
-            if not species_lookup.data:
-                match = taxonomy_df[taxonomy_df["SPECIES_CODE"] == sp_code]
-                if not match.empty:
-                    print(f"➕ Adding species: {sp_code}")
+            if sp_code not in known_codes:
+                match = TAX_MAP.get(sp_code)
+                if match:
+                    com_name, sci_name = match
                     supabase.table("SGBird").insert({
                         "species_code": sp_code,
-                        "com_name": match.iloc[0]["PRIMARY_COM_NAME"],
-                        "sci_name": match.iloc[0]["SCI_NAME"]
+                        "com_name": com_name,
+                        "sci_name": sci_name
                     }).execute()
+                    known_codes.add(sp_code)
                 else:
                     print(f"⚠️ Skipped unknown species: {sp_code}")
                     continue
 
-            try:
-                obs_dt = datetime.fromisoformat(obs_dt_raw).date().isoformat()
-            except:
+            # obsDt は "YYYY-MM-DD HH:MM" か "YYYY-MM-DD" なので先頭10文字が日付
+            if len(obs_dt_raw) < 10 or obs_dt_raw[4] != "-" or obs_dt_raw[7] != "-":
                 continue
+            obs_dt = obs_dt_raw[:10]
 
-            existing = supabase.table("ObservationSG").select("id").match({
-                "obs_dt": obs_dt,
-                "lat": lat,
-                "lng": lng
-            }).execute()
-
-            if existing.data:
-                obs_id = existing.data[0]["id"]
-            else:
-                res = supabase.table("ObservationSG").insert({
+            # DB 側は float4 なので、eBird の値も同じ精度に揃えてから照合する
+            obs_key = (obs_dt, to_float4(lat), to_float4(lng))
+            if obs_key not in existing_map and obs_key not in new_obs:
+                # 新規観測は溜めておき、まとめて insert する
+                new_obs[obs_key] = {
                     "obs_dt": obs_dt,
                     "lat": lat,
                     "lng": lng,
-                    "location_name": obs.get("locationName"),
-                    "location_id": obs.get("locID") or obs.get("locationID"),
-                    "obs_valid": obs.get("obsValid", True),
-                    "obs_reviewed": obs.get("obsReviewed", False),
-                    "user_display_name": obs.get("userDisplayName"),
-                    "subnational1_name": obs.get("subnational1Name"),
-                    "subnational2_name": obs.get("subnational2Name"),
-                }).execute()
-                obs_id = res.data[0]["id"]
-
-            bird_batch.append({
-                "observation_id": obs_id,
-                "species_code": sp_code,
-                "how_many": obs.get("howMany")
-            })
+                    "location_name": g("locationName"),
+                    "location_id": g("locID") or g("locationID"),
+                    "obs_valid": g("obsValid", True),
+                    "obs_reviewed": g("obsReviewed", False),
+                    "user_display_name": g("userDisplayName"),
+                    "subnational1_name": g("subnational1Name"),
+                    "subnational2_name": g("subnational2Name"),
+                }
+
+            bird_batch.append((obs_key, sp_code, g("howMany")))
 
             if len(bird_batch) >= BATCH_SIZE:
-                supabase.table("ObservationSGBird").insert(bird_batch).execute()
-                print(f"  ✅ Batch inserted ({len(bird_batch)})")
+                # ObservationSGBird が参照する観測を先に登録
+                if new_obs:
+                    insert_new_observations(new_obs, existing_map)
+                insert_bird_batch(bird_batch, existing_map)
                 day_inserted += len(bird_batch)
                 total_inserted += len(bird_batch)
                 batch_count += 1
                 bird_batch.clear()
-                time.sleep(INSERT_PAUSE)
+
+        if new_obs:
+            insert_new_observations(new_obs, existing_map)
 
         if bird_batch:
-            supabase.table("ObservationSGBird").insert(bird_batch).execute()
-            print(f"  ✅ Final batch inserted ({len(bird_batch)})")
+            insert_bird_batch(bird_batch, existing_map)
             day_inserted += len(bird_batch)
             total_inserted += len(bird_batch)
             batch_count += 1
@@ -138,17 +208,25 @@ def run_sync():
         print(f"✅ Done {date_str}: {day_inserted} records in {batch_count} batch(es). Total so far: {total_inserted}")
         save_progress(current)
         current += timedelta(days=1)
-        time.sleep(RATE_SLEEP)
+
+        # 残りリクエスト数が少ないときだけ待つ
+        remaining = r.headers.get("X-RateLimit-Remaining")
+        if remaining is not None and remaining.isdigit() and int(remaining) <= RATE_LIMIT_FLOOR:
+            time.sleep(RATE_SLEEP)
 
     print(f"\n🎉 All done! Total inserted: {total_inserted}")
 
 
 # ---------------- 再実行ラッパー ---------------- #
+# プロセスを再起動せずに再実行し、セッションやキャッシュを保持する
 if __name__ == "__main__":
-    try:
-        run_sync()
-    except Exception as e:
-        print(f"🛑 Script crashed with error: {e}")
-        print("🔁 Restarting in 5 minutes...")
-        time.sleep(300)  # 5 minutes
-        os.execv(sys.executable, [sys.executable] + sys.argv)
+    while True:
+        try:
+            run_sync()
+            break
+        except KeyboardInterrupt:
+            raise
+        except Exception as e:
+            print(f"🛑 Script crashed with error: {e}")
+            print("🔁 Restarting in 5 minutes...")
+            time.sleep(300)  # 5 minutes
@@ -1,6 +1,6 @@
 import os
+import csv
 import requests
-import pandas as pd
 from dotenv import load_dotenv
 from supabase import create_client, Client
 
@@ -25,33 +25,38 @@ def fetch_species_codes_from_ebird():
     return response.json()  # speciesCode list
 
 def load_taxonomy_csv():
+    """taxonomy.csv を species_code -> (PRIMARY_COM_NAME, SCI_NAME) の dict として読み込む"""
     csv_path = os.path.join(os.path.dirname(__file__), "..", "data", "eBird_taxonomy_v2024.csv")
-    return pd.read_csv(csv_path)
+    with open(csv_path, encoding="utf-8") as f:
+        return {r['SPECIES_CODE']: (r['PRIMARY_COM_NAME'], r['SCI_NAME']) for r in csv.DictReader(f)}
 
-def save_sg_birds(species_codes, taxonomy_df):
-    added = 0
+def save_sg_birds(species_codes, tax_map):
+    # 既存の SGBird を一括取得して存在確認をローカルで行う
+    existing = {r["species_code"] for r in supabase.table("SGBird").select("species_code").execute().data}
+
+    new_rows = []
     for code in species_codes:
-        match = taxonomy_df[taxonomy_df['SPECIES_CODE'] == code]
-        if not match.empty:
-            com_name = match.iloc[0]['PRIMARY_COM_NAME']
-            sci_name = match.iloc[0]['SCI_NAME']
-
-            # Check if bird already exists in Supabase
-            existing = supabase.table("SGBird").select("id").eq("species_code", code).execute()
-            if existing.data:
+        match = tax_map.get(code)
+        if match:
+            if code in existing:
                 continue  # already exists
 
-            # Insert new record
-            res = supabase.table("SGBird").insert({
+            com_name, sci_name = match
+            new_rows.append({
                 "species_code": code,
                 "com_name": com_name,
                 "sci_name": sci_name
-            }).execute()
-            if res.data:
-                added += 1
+            })
+            existing.add(code)
         else:
             print(f"❌ Species code not found in taxonomy CSV: {code}")
 
+    # Insert new records in one batch
+    added = 0
+    if new_rows:
+        res = supabase.table("SGBird").insert(new_rows).execute()
+        added = len(res.data or [])
+
     print(f"✅ Completed. {added} new birds added.")
 
 def main():
@@ -61,10 +66,10 @@ def main():
         print(f"🌟 {len(species_codes)} species codes retrieved.")
 
         print("📚 Loading taxonomy CSV...")
-        taxonomy_df = load_taxonomy_csv()
+        tax_map = load_taxonomy_csv()
 
         print("💾 Saving SGBird records to Supabase...")
-        save_sg_birds(species_codes, taxonomy_df)
+        save_sg_birds(species_codes, tax_map)
 
     except Exception as e:
         print(f"❌ Error: {e}")
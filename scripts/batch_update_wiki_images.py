@@ -11,15 +11,13 @@ import sys
 import time
 import logging
 import asyncio
+import sqlite3
 import aiohttp
-from typing import Optional, Dict, Any, List
+from typing import Optional, Dict, Any, List, Set, Tuple
 from dataclasses import dataclass
-from urllib.parse import quote
 import json
 from supabase import create_client, Client
 from dotenv import load_dotenv
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import threading
 
 # Load environment variables
 load_dotenv()
@@ -35,6 +33,13 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Local cache of names Wikipedia has no article for, re-checked after this many seconds
+MISS_CACHE_PATH = 'wiki_cache.db'
+MISS_CACHE_TTL = 30 * 86400
+
+# Maximum number of titles the MediaWiki Action API accepts per query
+TITLES_PER_REQUEST = 50
+
 @dataclass
 class BatchUpdateResult:
     """Result of batch update operation"""
@@ -53,11 +58,14 @@ class BatchWikiImageUpdater:
         self.max_workers = max_workers
         self.supabase = self._init_supabase()
         self.result = BatchUpdateResult()
-        self.lock = threading.Lock()
         
-        # Rate limiting
-        self.request_delay = 0.2  # seconds between requests per worker
-        self.last_request_times = {}
+        # Concurrency limit for in-flight Wikipedia requests (created inside the event loop)
+        self.max_concurrent_requests = self.max_workers * 10
+        self.semaphore: Optional[asyncio.Semaphore] = None
+        
+        # Persistent negative cache so re-runs skip known misses (in-memory for dry runs)
+        self.cache = sqlite3.connect(':memory:' if self.dry_run else MISS_CACHE_PATH)
+        self.cache.execute('CREATE TABLE IF NOT EXISTS misses (name TEXT PRIMARY KEY, ts REAL)')
     
     def _init_supabase(self) -> Client:
         """Initialize Supabase client"""
@@ -73,128 +81,89 @@ class BatchWikiImageUpdater:
         
         return create_client(url, key)
     
-    def _rate_limit(self, worker_id: int):
-        """Implement per-worker rate limiting"""
-        current_time = time.time()
-        last_time = self.last_request_times.get(worker_id, 0)
-        time_since_last = current_time - last_time
+    async def search_wikipedia(self, session: aiohttp.ClientSession, names: List[str]) -> Tuple[Dict[str, Optional[Dict[str, Any]]], Set[str]]:
+        """Look up many names concurrently, TITLES_PER_REQUEST titles per Wikipedia query
         
-        if time_since_last < self.request_delay:
-            time.sleep(self.request_delay - time_since_last)
+        Returns a mapping of name to page data (None when there is no article)
+        and the set of names whose request failed.
+        """
+        chunks = [names[i:i + TITLES_PER_REQUEST] for i in range(0, len(names), TITLES_PER_REQUEST)]
+        chunk_results = await asyncio.gather(
+            *[self._search_wikipedia_titles(session, chunk) for chunk in chunks],
+            return_exceptions=True
+        )
         
-        self.last_request_times[worker_id] = time.time()
-    
-    def search_wikipedia_sync(self, scientific_name: str, common_name: str = None, worker_id: int = 0) -> Dict[str, Any]:
-        """Synchronous Wikipedia search for thread pool"""
-        self._rate_limit(worker_id)
+        found = {}
+        failed = set()
+        for chunk, chunk_result in zip(chunks, chunk_results):
+            if isinstance(chunk_result, Exception):
+                logger.error(f"Error searching Wikipedia for {len(chunk)} titles: {chunk_result}")
+                failed.update(chunk)
+            else:
+                found.update(chunk_result)
         
-        result = {
-            'wikipedia_url': None,
-            'image_url': None,
-            'success': False,
-            'error': None
+        return found, failed
+    
+    def _is_recent_miss(self, name: str) -> bool:
+        """Check whether name had no Wikipedia article within the cache TTL"""
+        row = self.cache.execute('SELECT ts FROM misses WHERE name = ?', (name,)).fetchone()
+        return row is not None and time.time() - row[0] < MISS_CACHE_TTL
+    
+    def _record_miss(self, name: str) -> None:
+        """Remember that name had no Wikipedia article"""
+        self.cache.execute('INSERT OR REPLACE INTO misses VALUES (?, ?)', (name, time.time()))
+    
+    async def _search_wikipedia_titles(self, session: aiohttp.ClientSession, names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Resolve up to TITLES_PER_REQUEST names (page URL and image) in one MediaWiki query"""
+        api_url = "https://en.wikipedia.org/w/api.php"
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'titles': '|'.join(names),
+            'prop': 'pageimages|info|pageprops',
+            'inprop': 'url',
+            'ppprop': 'disambiguation',
+            'pithumbsize': 500,
+            'pilimit': TITLES_PER_REQUEST,
+            'redirects': 1
         }
         
-        try:
-            import requests
-            session = requests.Session()
-            session.headers.update({
-                'User-Agent': 'AviAtlas/1.0 Bird Taxonomy Updater'
-            })
-            
-            # Try scientific name first
-            wiki_data = self._search_wikipedia_by_name_sync(session, scientific_name)
-            
-            # If not found and we have common name, try that
-            if not wiki_data and common_name:
-                wiki_data = self._search_wikipedia_by_name_sync(session, common_name)
-            
-            if wiki_data:
-                result.update(wiki_data)
-                result['success'] = True
-                
-                with self.lock:
-                    if result['wikipedia_url']:
-                        self.result.wikipedia_found += 1
-                    if result['image_url']:
-                        self.result.images_found += 1
-            
-        except Exception as e:
-            result['error'] = str(e)
-            logger.error(f"Error searching Wikipedia for {scientific_name}: {e}")
-            with self.lock:
-                self.result.errors += 1
+        # Request errors propagate to the caller so they are not cached as misses
+        async with self.semaphore:
+            async with session.get(api_url, params=params) as response:
+                response.raise_for_status()
+                data = await response.json()
         
-        return result
-    
-    def _search_wikipedia_by_name_sync(self, session, name: str) -> Optional[Dict[str, Any]]:
-        """Synchronous Wikipedia search for a specific name"""
-        search_url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + quote(name)
+        query = data.get('query', {})
+        normalized = {item['from']: item['to'] for item in query.get('normalized', [])}
+        redirects = {item['from']: item['to'] for item in query.get('redirects', [])}
+        pages_by_title = {page['title']: page for page in query.get('pages', {}).values() if 'title' in page}
         
-        try:
-            response = session.get(search_url, timeout=10)
+        results = {}
+        for name in names:
+            # Follow MediaWiki's title normalization and redirects back to the requested name
+            title = normalized.get(name, name)
+            title = redirects.get(title, title)
+            page_data = pages_by_title.get(title)
             
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Check if it's a disambiguation page or not found
-                if data.get('type') == 'disambiguation':
-                    return None
-                
-                result = {
-                    'wikipedia_url': data.get('content_urls', {}).get('desktop', {}).get('page'),
-                    'image_url': None
+            # Skip missing pages and disambiguation pages
+            if (page_data is None or 'missing' in page_data or 'invalid' in page_data
+                    or 'disambiguation' in page_data.get('pageprops', {})):
+                results[name] = None
+            else:
+                results[name] = {
+                    'wikipedia_url': page_data.get('fullurl'),
+                    'image_url': page_data.get('thumbnail', {}).get('source')
                 }
-                
-                # Try to get the main image
-                if 'thumbnail' in data:
-                    result['image_url'] = data['thumbnail'].get('source')
-                elif 'originalimage' in data:
-                    result['image_url'] = data['originalimage'].get('source')
-                
-                # If no image from summary, try to get from page content
-                if not result['image_url'] and result['wikipedia_url']:
-                    result['image_url'] = self._get_wikipedia_image_sync(session, name)
-                
-                return result
-                
-        except Exception as e:
-            logger.warning(f"Request failed for {name}: {e}")
-        
-        return None
-    
-    def _get_wikipedia_image_sync(self, session, page_title: str) -> Optional[str]:
-        """Get the main image from a Wikipedia page synchronously"""
-        try:
-            api_url = "https://en.wikipedia.org/w/api.php"
-            params = {
-                'action': 'query',
-                'format': 'json',
-                'titles': page_title,
-                'prop': 'pageimages',
-                'pithumbsize': 500,
-                'pilimit': 1
-            }
-            
-            response = session.get(api_url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                pages = data.get('query', {}).get('pages', {})
-                
-                for page_id, page_data in pages.items():
-                    if 'thumbnail' in page_data:
-                        return page_data['thumbnail']['source']
-        
-        except Exception as e:
-            logger.warning(f"Failed to get image for {page_title}: {e}")
         
-        return None
+        return results
     
-    def get_species_batch(self, offset: int = 0, limit: int = 100) -> List[Dict[str, Any]]:
-        """Get a batch of species that need Wikipedia/image updates"""
+    def get_species_batch(self, last_id: Optional[str] = None, limit: int = 100) -> List[Dict[str, Any]]:
+        """Get the next batch of species (ordered by id, after last_id) that need Wikipedia/image updates"""
         if self.dry_run:
-            # Return sample data for dry run
+            # Return a single page of sample data for dry run
+            if last_id is not None:
+                return []
             return [
                 {
                     'id': f'sample-{i}',
@@ -202,15 +171,19 @@ class BatchWikiImageUpdater:
                     'common_name': f'Common Name {i}',
                     'rank': 'species'
                 }
-                for i in range(offset, min(offset + limit, offset + 10))
+                for i in range(min(limit, 10))
             ]
         
         try:
-            response = self.supabase.table('bird_taxonomy').select(
+            # Keyset pagination: seek past the last seen id instead of OFFSET
+            query = self.supabase.table('bird_taxonomy').select(
                 'id, scientific_name, common_name, rank, wikipedia_url, image_url'
-            ).eq('rank', 'species').is_('wikipedia_url', 'null').range(
-                offset, offset + limit - 1
-            ).execute()
+            ).eq('rank', 'species').is_('wikipedia_url', 'null')
+            
+            if last_id is not None:
+                query = query.gt('id', last_id)
+            
+            response = query.order('id').limit(limit).execute()
             
             return response.data
             
@@ -230,28 +203,21 @@ class BatchWikiImageUpdater:
             return len(updates)
         
         try:
-            # Prepare batch update data
-            batch_data = []
-            for update in updates:
-                update_data = {'id': update['id']}
-                
-                if update.get('wikipedia_url'):
-                    update_data['wikipedia_url'] = update['wikipedia_url']
-                
-                if update.get('image_url'):
-                    update_data['image_url'] = update['image_url']
-                
-                if len(update_data) > 1:  # More than just ID
-                    update_data['updated_at'] = 'now()'
-                    batch_data.append(update_data)
+            # Prepare column arrays for the bulk update RPC
+            batch_data = [
+                update for update in updates
+                if update.get('wikipedia_url') or update.get('image_url')
+            ]
             
             if batch_data:
-                # Use upsert for batch updates
-                response = self.supabase.table('bird_taxonomy').upsert(
-                    batch_data, on_conflict='id'
-                ).execute()
+                # Single UPDATE ... FROM unnest(...) on the server; NULLs keep existing values
+                response = self.supabase.rpc('bulk_update_wiki', {
+                    'ids': [update['id'] for update in batch_data],
+                    'wikis': [update.get('wikipedia_url') for update in batch_data],
+                    'imgs': [update.get('image_url') for update in batch_data]
+                }).execute()
                 
-                updated_count = len(response.data) if response.data else 0
+                updated_count = response.data or 0
                 logger.info(f"Updated {updated_count} species in batch")
                 return updated_count
             else:
@@ -260,98 +226,122 @@ class BatchWikiImageUpdater:
                 
         except Exception as e:
             logger.error(f"Error updating species batch: {e}")
-            with self.lock:
-                self.result.errors += len(updates)
+            self.result.errors += len(updates)
             return 0
     
-    def process_species_batch(self, species_batch: List[Dict[str, Any]], batch_num: int) -> List[Dict[str, Any]]:
-        """Process a batch of species with parallel Wikipedia searches"""
+    async def process_species_batch(self, session: aiohttp.ClientSession, species_batch: List[Dict[str, Any]], batch_num: int) -> List[Dict[str, Any]]:
+        """Process a batch of species with batched, concurrent Wikipedia searches"""
         logger.info(f"Processing batch {batch_num} with {len(species_batch)} species")
         
         updates = []
         
-        # Use ThreadPoolExecutor for parallel processing
-        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            future_to_species = {
-                executor.submit(
-                    self.search_wikipedia_sync,
-                    species['scientific_name'],
-                    species.get('common_name'),
-                    i % self.max_workers
-                ): species
-                for i, species in enumerate(species_batch)
-            }
+        to_search = []
+        for species in species_batch:
+            if self._is_recent_miss(species['scientific_name']):
+                logger.debug(f"Skipping {species['scientific_name']} - no Wikipedia article on last attempt")
+                self.result.skipped += 1
+                self.result.total_processed += 1
+            else:
+                to_search.append(species)
+        
+        # Try scientific names first
+        sci_results, failed = await self.search_wikipedia(
+            session, [species['scientific_name'] for species in to_search]
+        )
+        
+        # If not found and we have common name, try that
+        fallback_names = [
+            species['common_name'] for species in to_search
+            if species.get('common_name')
+            and species['scientific_name'] not in failed
+            and not sci_results.get(species['scientific_name'])
+        ]
+        common_results, common_failed = await self.search_wikipedia(session, fallback_names)
+        
+        # Collect results
+        for species in to_search:
+            scientific_name = species['scientific_name']
+            common_name = species.get('common_name')
+            self.result.total_processed += 1
             
-            # Collect results
-            for future in as_completed(future_to_species):
-                species = future_to_species[future]
-                
-                try:
-                    wiki_result = future.result()
-                    
-                    if wiki_result['success']:
-                        update_data = {'id': species['id']}
-                        
-                        if wiki_result['wikipedia_url']:
-                            update_data['wikipedia_url'] = wiki_result['wikipedia_url']
-                        
-                        if wiki_result['image_url']:
-                            update_data['image_url'] = wiki_result['image_url']
-                        
-                        if len(update_data) > 1:  # More than just ID
-                            updates.append(update_data)
-                    
-                    with self.lock:
-                        self.result.total_processed += 1
-                    
-                except Exception as e:
-                    logger.error(f"Error processing {species['scientific_name']}: {e}")
-                    with self.lock:
-                        self.result.errors += 1
+            if scientific_name in failed or common_name in common_failed:
+                self.result.errors += 1
+                continue
+            
+            wiki_result = sci_results.get(scientific_name) or common_results.get(common_name)
+            if not wiki_result:
+                self._record_miss(scientific_name)
+                continue
+            
+            update_data = {'id': species['id']}
+            
+            if wiki_result['wikipedia_url']:
+                update_data['wikipedia_url'] = wiki_result['wikipedia_url']
+                self.result.wikipedia_found += 1
+            
+            if wiki_result['image_url']:
+                update_data['image_url'] = wiki_result['image_url']
+                self.result.images_found += 1
+            
+            if len(update_data) > 1:  # More than just ID
+                updates.append(update_data)
         
         return updates
     
     def run_batch_update(self, total_limit: int = None, batch_size: int = 50) -> BatchUpdateResult:
         """Run the batch update process"""
+        return asyncio.run(self._run_batch_update(total_limit, batch_size))
+    
+    async def _run_batch_update(self, total_limit: int = None, batch_size: int = 50) -> BatchUpdateResult:
+        """Run the batch update process on a single shared HTTP session"""
         start_time = time.time()
         logger.info(f"Starting batch Wikipedia and image update (dry_run={self.dry_run})")
-        logger.info(f"Batch size: {batch_size}, Max workers: {self.max_workers}")
+        logger.info(f"Batch size: {batch_size}, Max concurrent requests: {self.max_concurrent_requests}")
         
-        offset = 0
+        self.semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        last_id = None
+        batch_num = 0
         processed_total = 0
         
-        while True:
-            # Get next batch of species
-            species_batch = self.get_species_batch(offset, batch_size)
-            
-            if not species_batch:
-                logger.info("No more species to process")
-                break
-            
-            # Check if we've reached the limit
-            if total_limit and processed_total >= total_limit:
-                logger.info(f"Reached processing limit of {total_limit}")
-                break
-            
-            # Process this batch
-            batch_num = (offset // batch_size) + 1
-            updates = self.process_species_batch(species_batch, batch_num)
-            
-            # Update database with results
-            if updates:
-                updated_count = self.update_species_batch(updates)
-                logger.info(f"Batch {batch_num}: {updated_count} species updated")
-            
-            processed_total += len(species_batch)
-            offset += batch_size
-            
-            # Progress update
-            logger.info(f"Progress: {processed_total} species processed")
-            
-            # Small delay between batches
-            time.sleep(1)
+        # Keep one session open across all batches so connections are reused
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrent_requests, ttl_dns_cache=300),
+            headers={'User-Agent': 'AviAtlas/1.0 Bird Taxonomy Updater'},
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as session:
+            while True:
+                # Get next batch of species
+                species_batch = self.get_species_batch(last_id, batch_size)
+                
+                if not species_batch:
+                    logger.info("No more species to process")
+                    break
+                
+                # Check if we've reached the limit
+                if total_limit and processed_total >= total_limit:
+                    logger.info(f"Reached processing limit of {total_limit}")
+                    break
+                
+                # Process this batch
+                batch_num += 1
+                updates = await self.process_species_batch(session, species_batch, batch_num)
+                
+                # Update database with results
+                if updates:
+                    updated_count = self.update_species_batch(updates)
+                    logger.info(f"Batch {batch_num}: {updated_count} species updated")
+                
+                self.cache.commit()
+                processed_total += len(species_batch)
+                last_id = species_batch[-1]['id']
+                
+                # Progress update
+                logger.info(f"Progress: {processed_total} species processed")
+                
+                # Small delay between batches
+                await asyncio.sleep(1)
         
+        self.cache.close()
         self.result.duration = time.time() - start_time
         self._print_final_stats()
         
@@ -359,18 +349,22 @@ class BatchWikiImageUpdater:
     
     def _print_final_stats(self) -> None:
         """Print final statistics"""
-        logger.info("\n" + "="*60)
-        logger.info("BATCH WIKIPEDIA AND IMAGE UPDATE SUMMARY")
-        logger.info("="*60)
-        logger.info(f"Total processed: {self.result.total_processed}")
-        logger.info(f"Wikipedia URLs found: {self.result.wikipedia_found}")
-        logger.info(f"Image URLs found: {self.result.images_found}")
-        logger.info(f"Errors: {self.result.errors}")
-        logger.info(f"Skipped: {self.result.skipped}")
-        logger.info(f"Duration: {self.result.duration:.2f} seconds")
+        lines = [
+            "",
+            "=" * 60,
+            "BATCH WIKIPEDIA AND IMAGE UPDATE SUMMARY",
+            "=" * 60,
+            f"Total processed: {self.result.total_processed}",
+            f"Wikipedia URLs found: {self.result.wikipedia_found}",
+            f"Image URLs found: {self.result.images_found}",
+            f"Errors: {self.result.errors}",
+            f"Skipped: {self.result.skipped}",
+            f"Duration: {self.result.duration:.2f} seconds",
+        ]
         if self.result.total_processed > 0:
-            logger.info(f"Rate: {self.result.total_processed/self.result.duration:.1f} species/second")
-        logger.info("="*60)
+            lines.append(f"Rate: {self.result.total_processed/self.result.duration:.1f} species/second")
+        lines.append("=" * 60)
+        logger.info("\n".join(lines))
 
 def main():
     """Main function"""
@@ -380,7 +374,7 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Run without making database changes')
     parser.add_argument('--limit', type=int, help='Limit total number of species to process')
     parser.add_argument('--batch-size', type=int, default=50, help='Number of species per batch')
-    parser.add_argument('--workers', type=int, default=5, help='Number of parallel workers')
+    parser.add_argument('--workers', type=int, default=5, help='Number of parallel workers (up to 10 in-flight requests each)')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
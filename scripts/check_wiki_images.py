@@ -30,21 +30,12 @@ def check_status():
     
     print("🔍 Checking Wikipedia and Image URL Status...\n")
     
-    # Get overall statistics
-    total_species = supabase.table('bird_taxonomy').select('id', count='exact').eq('rank', 'species').execute()
-    total_count = total_species.count
-    
-    # Count species with Wikipedia URLs
-    wiki_species = supabase.table('bird_taxonomy').select('id', count='exact').eq('rank', 'species').not_.is_('wikipedia_url', 'null').execute()
-    wiki_count = wiki_species.count
-    
-    # Count species with image URLs
-    image_species = supabase.table('bird_taxonomy').select('id', count='exact').eq('rank', 'species').not_.is_('image_url', 'null').execute()
-    image_count = image_species.count
-    
-    # Count species with both
-    both_species = supabase.table('bird_taxonomy').select('id', count='exact').eq('rank', 'species').not_.is_('wikipedia_url', 'null').not_.is_('image_url', 'null').execute()
-    both_count = both_species.count
+    # Get overall statistics (all counts computed server-side in a single scan)
+    coverage = supabase.rpc('bird_taxonomy_coverage').execute().data[0]
+    total_count = coverage['total_species']
+    wiki_count = coverage['with_wikipedia']
+    image_count = coverage['with_image']
+    both_count = coverage['with_both']
     
     print(f"📊 **Overall Statistics:**")
     print(f"   Total species: {total_count:,}")
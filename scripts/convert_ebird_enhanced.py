@@ -5,47 +5,90 @@ Enhanced eBird Taxonomy CSV to Supabase Converter
 Improved version with better error handling, logging, and data validation.
 """
 
-import csv
 import os
 import re
+import sys
+import asyncio
 import logging
-import time
-from typing import Dict, List, Optional, Set, Tuple
+import logging.handlers
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 from dataclasses import dataclass, field
 from datetime import datetime
-from supabase import create_client, Client
+import httpx
+import pandas as pd
+from supabase import create_client, acreate_client, Client, AsyncClient, AsyncClientOptions, PostgrestAPIError
 from dotenv import load_dotenv
 from tqdm import tqdm
 
 # Load environment variables
 load_dotenv()
 
-# Configure logging
+# Configure logging (file writes are buffered and flushed on errors or at exit)
+LOG_FORMAT = '%(asctime)s - %(levelname)s - %(message)s'
+file_handler = logging.FileHandler('/Users/shuna/aviatlas/scripts/conversion.log', delay=True)
+file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
 logging.basicConfig(
     level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s',
+    format=LOG_FORMAT,
     handlers=[
-        logging.FileHandler('/Users/shuna/aviatlas/scripts/conversion.log'),
+        logging.handlers.MemoryHandler(capacity=1024, target=file_handler),
         logging.StreamHandler()
     ]
 )
 logger = logging.getLogger(__name__)
 
-@dataclass
-class TaxonomyNode:
-    """Represents a node in the taxonomy hierarchy"""
-    name: str
-    rank: str
-    scientific_name: Optional[str] = None
-    common_name: Optional[str] = None
-    parent_id: Optional[str] = None
-    ebird_code: Optional[str] = None
-    order: Optional[str] = None
-    family: Optional[str] = None
-    species_group: Optional[str] = None
-    metadata: Dict = field(default_factory=dict)
+# Precompiled patterns for column-wise name validation and cleaning
+# Valid if it contains a hybrid/complex marker anywhere, or is a capitalized
+# genus followed only by letters, whitespace, hyphens and dots
+_VALID_SCI_NAME_RE = re.compile(r'.*[x/\[]|[A-Z][A-Za-z\s\-\.]*$')
+_FAMILY_HEAD_RE = re.compile(r'^([^(]+)')
+_WS_RE = re.compile(r'\s+')
+_GENUS_SKIP_RE = re.compile(r' x |/|\[')
 
-@dataclass
+# Node key normalization: spaces and hyphens become underscores
+_KEY_TRANS = str.maketrans({' ': '_', '-': '_'})
+
+# CSV columns used by the converter
+CSV_COLUMNS = ['TAXON_ORDER', 'CATEGORY', 'SPECIES_CODE', 'PRIMARY_COM_NAME', 'SCI_NAME',
+               'ORDER', 'FAMILY', 'SPECIES_GROUP', 'REPORT_AS']
+REQUIRED_FIELDS = ['SPECIES_CODE', 'PRIMARY_COM_NAME', 'SCI_NAME', 'ORDER', 'FAMILY']
+
+# Rows parsed per chunk; each chunk's new nodes are uploaded while the next is parsed
+CSV_CHUNK_SIZE = 5000
+
+# Taxonomy ranks in insertion order (parents before children)
+RANKS = ['class', 'order', 'family', 'genus', 'species']
+
+# Columnar node storage; parent_key is resolved to parent_id at insertion time
+NODE_COLUMNS = ['key', 'name', 'parent_key', 'scientific_name', 'common_name',
+                'ebird_code', 'order_name', 'family_name', 'species_group']
+
+# Ranks small enough to always go in a single insert, and the cap on auto-sized batches
+SINGLE_BATCH_RANKS = {'class', 'order'}
+MAX_BATCH_SIZE = 1000
+
+# Shared keep-alive pool for concurrent inserts (HTTP/2 multiplexes batches over one connection)
+HTTP_LIMITS = httpx.Limits(max_connections=32, max_keepalive_connections=32)
+HTTP_TIMEOUT = 30
+
+# SQLSTATE classes / PostgREST codes worth retrying: connection errors, deadlocks and
+# serialization failures, resource exhaustion, statement timeouts, and pool/connection errors
+TRANSIENT_ERROR_PREFIXES = ('08', '40', '53', '57', 'PGRST000', 'PGRST001', 'PGRST002', 'PGRST003')
+
+def is_transient_error(error: Exception) -> bool:
+    """Whether a failed insert is worth retrying (network or server-side, not bad data)"""
+    if isinstance(error, httpx.TransportError):  # Includes timeouts
+        return True
+    
+    if isinstance(error, PostgrestAPIError):
+        # Non-JSON error bodies (e.g. gateway errors) carry the HTTP status as the code
+        if isinstance(error.code, int):
+            return error.code >= 500
+        return str(error.code or '').startswith(TRANSIENT_ERROR_PREFIXES)
+    
+    return False
+
+@dataclass(slots=True)
 class ConversionStats:
     """Track conversion statistics"""
     total_csv_rows: int = 0
@@ -81,19 +124,22 @@ class EnhancedeBirdConverter:
                 )
             
             self.supabase: Client = create_client(supabase_url, supabase_key)
+            self.supabase_url = supabase_url
+            self.supabase_key = supabase_key
             logger.info("Connected to Supabase")
         else:
             self.supabase = None
             logger.info("Running in DRY RUN mode - no database operations")
         
-        # Storage for taxonomy nodes
-        self.nodes: Dict[str, TaxonomyNode] = {}
+        # Storage for taxonomy nodes not yet handed off, one dict of column lists per rank
+        self.rank_rows: Dict[str, Dict[str, List]] = self._empty_rank_rows()
+        self.rank_counts: Dict[str, int] = {rank: 0 for rank in RANKS}
+        self.rank_keys: Dict[str, Set[str]] = {rank: set() for rank in RANKS}  # Created keys, for dedup
         self.node_ids: Dict[str, str] = {}  # Maps node key to UUID
         
-        # Track processed items to avoid duplicates
-        self.processed_orders: Set[str] = set()
-        self.processed_families: Set[str] = set()
-        self.processed_genera: Set[str] = set()
+        # Keys of created parents, kept across CSV chunks
+        self.family_keys: Dict[Tuple[str, str], str] = {}
+        self.genus_keys: Dict[str, str] = {}
         
         # Data quality tracking
         self.data_quality = {
@@ -103,90 +149,88 @@ class EnhancedeBirdConverter:
             'hierarchy_inconsistencies': []
         }
     
-    def validate_csv_row(self, row: Dict, row_num: int) -> Tuple[bool, List[str]]:
-        """Validate a single CSV row"""
-        errors = []
-        
-        # Check required fields
-        required_fields = ['SPECIES_CODE', 'PRIMARY_COM_NAME', 'SCI_NAME', 'ORDER', 'FAMILY']
-        for field in required_fields:
-            if not row.get(field, '').strip():
-                errors.append(f"Row {row_num}: Missing {field}")
+    def validate_rows(self, df: pd.DataFrame) -> pd.Series:
+        """Validate all CSV rows column-wise and return a mask of valid rows"""
+        # Check required fields in one mask
+        stripped = df[REQUIRED_FIELDS].apply(lambda col: col.str.strip())
+        missing = stripped.eq('')
         
         # Validate scientific name format
-        sci_name = row.get('SCI_NAME', '').strip()
-        if sci_name and not self._is_valid_scientific_name(sci_name):
-            errors.append(f"Row {row_num}: Invalid scientific name format: {sci_name}")
-            self.data_quality['invalid_scientific_names'].append((row_num, sci_name))
+        sci_names = stripped['SCI_NAME']
+        bad_sci_names = ~missing['SCI_NAME'] & ~self._valid_scientific_names(sci_names)
         
         # Check for reasonable name lengths
-        if len(row.get('PRIMARY_COM_NAME', '')) > 200:
-            errors.append(f"Row {row_num}: Common name too long")
-        
-        return len(errors) == 0, errors
+        long_com_names = df['PRIMARY_COM_NAME'].str.len() > 200
+        
+        invalid = missing.any(axis=1) | bad_sci_names | long_com_names
+        
+        # Build messages only for the invalid rows, in row order
+        for idx in df.index[invalid]:
+            row_num = idx + 1
+            for field in REQUIRED_FIELDS:
+                if missing.at[idx, field]:
+                    self.stats.errors.append(f"Row {row_num}: Missing {field}")
+            if bad_sci_names.at[idx]:
+                self.stats.errors.append(f"Row {row_num}: Invalid scientific name format: {sci_names.at[idx]}")
+                self.data_quality['invalid_scientific_names'].append((row_num, sci_names.at[idx]))
+            if long_com_names.at[idx]:
+                self.stats.errors.append(f"Row {row_num}: Common name too long")
+        
+        return ~invalid
     
-    def _is_valid_scientific_name(self, sci_name: str) -> bool:
-        """Enhanced scientific name validation"""
-        # Skip hybrid names and complex cases
-        if any(char in sci_name for char in ['x', '/', '[']):
-            return True  # These are valid but complex cases
-        
-        # Basic binomial nomenclature check
-        parts = sci_name.split()
-        if len(parts) < 1:
-            return False
-        
-        # First part should be capitalized (genus)
-        if not parts[0][0].isupper():
-            return False
-        
-        # Check for reasonable character set
-        if not re.match(r'^[A-Za-z\s\-\.]+$', sci_name):
-            return False
-        
-        return True
+    def _valid_scientific_names(self, sci_names: pd.Series) -> pd.Series:
+        """Enhanced scientific name validation over a column of stripped names"""
+        # Hybrid/complex names, or a capitalized genus followed by a reasonable character set
+        return sci_names.str.match(_VALID_SCI_NAME_RE)
     
-    def clean_family_name(self, family_str: str) -> str:
-        """Extract clean family name from eBird family string"""
-        if not family_str:
-            return ''
+    def clean_family_names(self, families: pd.Series) -> pd.Series:
+        """Extract clean family names from a column of eBird family strings"""
+        stripped = families.str.strip()
         
         # Remove parenthetical descriptions like "(Ostriches)"
-        match = re.match(r'^([^(]+)', family_str.strip())
-        cleaned = match.group(1).strip() if match else family_str.strip()
+        cleaned = stripped.str.extract(_FAMILY_HEAD_RE, expand=False).str.strip().fillna(stripped)
         
         # Additional cleaning
-        cleaned = re.sub(r'\s+', ' ', cleaned)  # Normalize whitespace
-        return cleaned
+        return cleaned.str.replace(_WS_RE, ' ', regex=True)  # Normalize whitespace
     
-    def extract_genus_from_scientific_name(self, sci_name: str) -> Optional[str]:
-        """Extract genus from scientific name with better error handling"""
-        if not sci_name or sci_name.strip() == '':
-            return None
+    def extract_genera(self, sci_names: pd.Series) -> pd.Series:
+        """Extract genera from a column of scientific names (None where unavailable)"""
+        first_parts = sci_names.str.strip().str.split(n=1).str[0]
         
         # Handle hybrid names and complex cases
-        if ' x ' in sci_name or '/' in sci_name or '[' in sci_name:
-            return None
-        
-        try:
-            parts = sci_name.strip().split()
-            if len(parts) >= 1 and parts[0].isalpha():
-                return parts[0]
-        except Exception as e:
-            logger.warning(f"Error extracting genus from '{sci_name}': {e}")
+        usable = ~sci_names.str.contains(_GENUS_SKIP_RE) & first_parts.str.isalpha().fillna(False).astype(bool)
         
-        return None
+        return first_parts.where(usable, None)
+    
+    @staticmethod
+    def _empty_rank_rows() -> Dict[str, Dict[str, List]]:
+        return {rank: {col: [] for col in NODE_COLUMNS} for rank in RANKS}
+    
+    def take_new_nodes(self) -> Dict[str, Dict[str, List]]:
+        """Hand off the nodes created since the last call and start fresh columns"""
+        new_rows = self.rank_rows
+        self.rank_rows = self._empty_rank_rows()
+        for rank, columns in new_rows.items():
+            self.rank_counts[rank] += len(columns['key'])
+        return new_rows
+    
+    def add_node(self, rank: str, key: str, **values):
+        """Append a node to its rank's columns"""
+        self.rank_keys[rank].add(key)
+        columns = self.rank_rows[rank]
+        columns['key'].append(key)
+        for col in NODE_COLUMNS[1:]:
+            columns[col].append(values.get(col))
     
     def create_class_node(self) -> str:
         """Create the root Aves class node"""
         class_key = "class_aves"
-        if class_key not in self.nodes:
-            self.nodes[class_key] = TaxonomyNode(
+        if class_key not in self.rank_keys['class']:
+            self.add_node(
+                "class", class_key,
                 name="Aves",
-                rank="class",
                 scientific_name="Aves",
-                common_name="Birds",
-                metadata={"description": "Class of all birds"}
+                common_name="Birds"
             )
             logger.info("Created Aves class node")
         return class_key
@@ -197,43 +241,38 @@ class EnhancedeBirdConverter:
             raise ValueError("Order name cannot be empty")
         
         order_name = order_name.strip()
-        order_key = f"order_{order_name.lower().replace(' ', '_').replace('-', '_')}"
+        order_key = sys.intern(f"order_{order_name.lower().translate(_KEY_TRANS)}")
         
-        if order_key not in self.nodes and order_name not in self.processed_orders:
-            self.nodes[order_key] = TaxonomyNode(
+        if order_key not in self.rank_keys['order']:
+            self.add_node(
+                "order", order_key,
                 name=order_name,
-                rank="order",
                 scientific_name=order_name,
                 common_name=order_name,
-                parent_id=class_key,
-                metadata={"created_from": "ebird_csv"}
+                parent_key=class_key
             )
-            self.processed_orders.add(order_name)
             logger.debug(f"Created order node: {order_name}")
         
         return order_key
     
-    def create_family_node(self, family_str: str, order_key: str) -> str:
-        """Create a family node with enhanced validation"""
+    def create_family_node(self, family_name: str, family_str: str, order_key: str) -> str:
+        """Create a family node from its cleaned name with enhanced validation"""
         if not family_str or family_str.strip() == '':
             raise ValueError("Family name cannot be empty")
         
-        family_name = self.clean_family_name(family_str)
         if not family_name:
             raise ValueError(f"Could not extract valid family name from: {family_str}")
         
-        family_key = f"family_{family_name.lower().replace(' ', '_').replace('-', '_')}"
+        family_key = sys.intern(f"family_{family_name.lower().translate(_KEY_TRANS)}")
         
-        if family_key not in self.nodes and family_name not in self.processed_families:
-            self.nodes[family_key] = TaxonomyNode(
+        if family_key not in self.rank_keys['family']:
+            self.add_node(
+                "family", family_key,
                 name=family_name,
-                rank="family",
                 scientific_name=family_name,
                 common_name=family_str,  # Keep original with description
-                parent_id=order_key,
-                metadata={"original_name": family_str}
+                parent_key=order_key
             )
-            self.processed_families.add(family_name)
             logger.debug(f"Created family node: {family_name}")
         
         return family_key
@@ -244,17 +283,16 @@ class EnhancedeBirdConverter:
             raise ValueError("Genus name cannot be empty")
         
         genus_name = genus_name.strip()
-        genus_key = f"genus_{genus_name.lower().replace(' ', '_')}"
+        genus_key = sys.intern(f"genus_{genus_name.lower().replace(' ', '_')}")
         
-        if genus_key not in self.nodes and genus_name not in self.processed_genera:
-            self.nodes[genus_key] = TaxonomyNode(
+        if genus_key not in self.rank_keys['genus']:
+            self.add_node(
+                "genus", genus_key,
                 name=genus_name,
-                rank="genus",
                 scientific_name=genus_name,
                 common_name=genus_name,
-                parent_id=family_key
+                parent_key=family_key
             )
-            self.processed_genera.add(genus_name)
             logger.debug(f"Created genus node: {genus_name}")
         
         return genus_key
@@ -264,29 +302,23 @@ class EnhancedeBirdConverter:
         species_code = row['SPECIES_CODE']
         species_key = f"species_{species_code}"
         
-        if species_key not in self.nodes:
-            self.nodes[species_key] = TaxonomyNode(
+        if species_key not in self.rank_keys['species']:
+            self.add_node(
+                "species", species_key,
                 name=row['PRIMARY_COM_NAME'],
-                rank="species",
                 scientific_name=row['SCI_NAME'],
                 common_name=row['PRIMARY_COM_NAME'],
-                parent_id=genus_key,
+                parent_key=genus_key,
                 ebird_code=species_code,
-                order=row['ORDER'],
-                family=row['FAMILY'],
-                species_group=row['SPECIES_GROUP'],
-                metadata={
-                    'taxon_order': row.get('TAXON_ORDER'),
-                    'category': row.get('CATEGORY'),
-                    'report_as': row.get('REPORT_AS')
-                }
+                order_name=row['ORDER'],
+                family_name=row['FAMILY'],
+                species_group=row['SPECIES_GROUP']
             )
-            logger.debug(f"Created species node: {row['PRIMARY_COM_NAME']} ({species_code})")
         
         return species_key
     
-    def process_csv_file(self, csv_file_path: str):
-        """Process the eBird CSV file with enhanced error handling"""
+    def iter_node_chunks(self, csv_file_path: str) -> Iterator[Dict[str, Dict[str, List]]]:
+        """Process the eBird CSV in chunks, yielding the nodes created by each chunk"""
         logger.info(f"Processing {csv_file_path}...")
         self.stats.start_time = datetime.now()
         
@@ -294,61 +326,21 @@ class EnhancedeBirdConverter:
         class_key = self.create_class_node()
         
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                # Get total rows for progress bar
-                total_rows = sum(1 for _ in open(csv_file_path, 'r', encoding='utf-8')) - 1
-                file.seek(0)
-                reader = csv.DictReader(file)
-                
-                with tqdm(total=total_rows, desc="Processing rows") as pbar:
-                    for i, row in enumerate(reader):
-                        self.stats.total_csv_rows += 1
-                        pbar.update(1)
-                        
-                        try:
-                            # Validate row
-                            is_valid, validation_errors = self.validate_csv_row(row, i + 1)
-                            if not is_valid:
-                                self.stats.errors.extend(validation_errors)
-                                self.stats.skipped_rows += 1
-                                continue
-                            
-                            # Skip non-species entries for now
-                            if row['CATEGORY'] != 'species':
-                                self.stats.skipped_rows += 1
-                                continue
-                            
-                            # Create hierarchy: Class -> Order -> Family -> Genus -> Species
-                            order_key = self.create_order_node(row['ORDER'], class_key)
-                            family_key = self.create_family_node(row['FAMILY'], order_key)
-                            
-                            # Extract genus from scientific name
-                            genus_name = self.extract_genus_from_scientific_name(row['SCI_NAME'])
-                            if genus_name:
-                                genus_key = self.create_genus_node(genus_name, family_key)
-                                species_key = self.create_species_node(row, genus_key)
-                            else:
-                                # If we can't extract genus, attach species directly to family
-                                species_key = self.create_species_node(row, family_key)
-                                self.stats.warnings.append(f"Row {i+1}: Could not extract genus from '{row['SCI_NAME']}'")
-                            
-                            self.stats.processed_species += 1
-                            
-                        except Exception as e:
-                            error_msg = f"Row {i+1}: {str(e)}"
-                            self.stats.errors.append(error_msg)
-                            logger.error(error_msg)
-                            continue
-        
+            reader = pd.read_csv(csv_file_path, usecols=CSV_COLUMNS, dtype=str,
+                                 keep_default_na=False, encoding='utf-8', chunksize=CSV_CHUNK_SIZE)
         except Exception as e:
             error_msg = f"Error reading CSV file: {str(e)}"
             self.stats.errors.append(error_msg)
             logger.error(error_msg)
             raise
         
-        self.stats.created_nodes = len(self.nodes)
+        with reader, tqdm(desc="Processing rows", unit="rows") as pbar:
+            for df in reader:
+                self.process_chunk(df, class_key)
+                pbar.update(len(df))
+                yield self.take_new_nodes()
+        
+        self.stats.created_nodes = sum(len(keys) for keys in self.rank_keys.values())
         logger.info(f"Built taxonomy tree with {self.stats.created_nodes} nodes")
         logger.info(f"Processed {self.stats.processed_species} species")
         
@@ -358,73 +350,180 @@ class EnhancedeBirdConverter:
         if self.stats.errors:
             logger.error(f"Encountered {len(self.stats.errors)} errors")
     
-    def insert_nodes_to_supabase(self, batch_size: int = 50):
-        """Insert all taxonomy nodes to Supabase with improved error handling"""
+    def process_csv_file(self, csv_file_path: str):
+        """Process the eBird CSV file without uploading anything"""
+        for _ in self.iter_node_chunks(csv_file_path):
+            pass
+    
+    def process_chunk(self, df: pd.DataFrame, class_key: str):
+        """Build taxonomy nodes for one chunk of CSV rows"""
+        self.stats.total_csv_rows += len(df)
+        
+        # Skip non-species entries for now, then validate only the rows that become nodes
+        species_df = df[df['CATEGORY'] == 'species']
+        species_df = species_df[self.validate_rows(species_df)]
+        self.stats.skipped_rows += len(df) - len(species_df)
+        
+        # Derive family and genus columns once for the whole chunk
+        species_df = species_df.assign(
+            FAMILY_NAME=self.clean_family_names(species_df['FAMILY']),
+            GENUS=self.extract_genera(species_df['SCI_NAME'])
+        )
+        
+        # Create each order, family and genus once instead of once per species row
+        order_keys = {order: self.create_order_node(order, class_key)
+                      for order in species_df['ORDER'].unique()}
+        
+        family_rows = species_df.drop_duplicates(['ORDER', 'FAMILY'])
+        for idx, order, family_str, family_name in family_rows[['ORDER', 'FAMILY', 'FAMILY_NAME']].itertuples():
+            try:
+                self.family_keys[(order, family_str)] = self.create_family_node(family_name, family_str, order_keys[order])
+            except Exception as e:
+                error_msg = f"Row {idx+1}: {str(e)}"
+                self.stats.errors.append(error_msg)
+                logger.error(error_msg)
+        
+        genus_rows = species_df[species_df['GENUS'].notna()].drop_duplicates('GENUS')
+        for idx, genus_name, order, family_str in genus_rows[['GENUS', 'ORDER', 'FAMILY']].itertuples():
+            family_key = self.family_keys.get((order, family_str))
+            if family_key:
+                self.genus_keys[genus_name] = self.create_genus_node(genus_name, family_key)
+        
+        rows = species_df.to_dict('records')
+        for idx, row in zip(species_df.index, rows):
+            family_key = self.family_keys.get((row['ORDER'], row['FAMILY']))
+            if family_key is None:
+                continue  # Family creation already reported an error
+            
+            try:
+                genus_key = self.genus_keys.get(row['GENUS'])
+                if genus_key:
+                    self.create_species_node(row, genus_key)
+                else:
+                    # If we can't extract genus, attach species directly to family
+                    self.create_species_node(row, family_key)
+                    self.stats.warnings.append(f"Row {idx+1}: Could not extract genus from '{row['SCI_NAME']}'")
+                
+                self.stats.processed_species += 1
+                
+            except Exception as e:
+                error_msg = f"Row {idx+1}: {str(e)}"
+                self.stats.errors.append(error_msg)
+                logger.error(error_msg)
+                continue
+    
+    def insert_nodes_to_supabase(self, csv_file_path: str, batch_size: int = 50, concurrency: int = 8):
+        """Process the CSV and insert its taxonomy nodes to Supabase as each chunk is built"""
         if self.dry_run:
             logger.info("DRY RUN: Would insert nodes to Supabase")
+            self.process_csv_file(csv_file_path)
             return
         
         logger.info("Inserting nodes to Supabase...")
-        
-        # Insert nodes in hierarchical order
-        insertion_order = ['class', 'order', 'family', 'genus', 'species']
-        
-        for rank in insertion_order:
-            rank_nodes = [(key, node) for key, node in self.nodes.items() if node.rank == rank]
-            logger.info(f"Inserting {len(rank_nodes)} {rank} nodes...")
-            
-            if not rank_nodes:
+        asyncio.run(self._insert_nodes_async(csv_file_path, batch_size, concurrency))
+    
+    async def _insert_nodes_async(self, csv_file_path: str, batch_size: int, concurrency: int):
+        """Parse CSV chunks in a worker thread while the previous chunk's nodes are uploaded"""
+        async with httpx.AsyncClient(limits=HTTP_LIMITS, http2=True, timeout=HTTP_TIMEOUT) as http_client:
+            client = await acreate_client(
+                self.supabase_url, self.supabase_key,
+                options=AsyncClientOptions(httpx_client=http_client)
+            )
+            await self._stream_chunks_async(client, csv_file_path, batch_size, concurrency)
+    
+    async def _stream_chunks_async(self, client: AsyncClient, csv_file_path: str,
+                                   batch_size: int, concurrency: int):
+        """Feed CSV chunks from a worker thread to the uploader, in order"""
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        
+        def produce():
+            try:
+                for chunk_nodes in self.iter_node_chunks(csv_file_path):
+                    asyncio.run_coroutine_threadsafe(queue.put(chunk_nodes), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+        
+        producer = asyncio.create_task(asyncio.to_thread(produce))
+        
+        # Chunks are uploaded in order, so parents from earlier chunks already have UUIDs
+        while (chunk_nodes := await queue.get()) is not None:
+            await self._insert_chunk_async(client, chunk_nodes, batch_size, concurrency)
+        
+        await producer
+    
+    async def _insert_chunk_async(self, client: AsyncClient, rank_rows: Dict[str, Dict[str, List]],
+                                  batch_size: int, concurrency: int):
+        """Insert one chunk's nodes rank by rank, uploading each rank's batches concurrently"""
+        # Insert nodes in hierarchical order (parents must exist before their children)
+        for rank in RANKS:
+            rank_df = pd.DataFrame(rank_rows[rank], columns=NODE_COLUMNS)
+            if rank_df.empty:
                 continue
             
-            # Process in batches
-            for i in tqdm(range(0, len(rank_nodes), batch_size), desc=f"Inserting {rank} nodes"):
-                batch = rank_nodes[i:i + batch_size]
-                batch_data = []
-                
-                for key, node in batch:
-                    # Resolve parent_id to actual UUID if it exists
-                    parent_uuid = None
-                    if node.parent_id and node.parent_id in self.node_ids:
-                        parent_uuid = self.node_ids[node.parent_id]
-                    
-                    data = {
-                        'name': node.name,
-                        'rank': node.rank,
-                        'parent_id': parent_uuid,
-                        'scientific_name': node.scientific_name,
-                        'common_name': node.common_name,
-                        'ebird_code': node.ebird_code,
-                        'order_name': node.order,
-                        'family_name': node.family,
-                        'species_group': node.species_group
-                    }
-                    batch_data.append(data)
-                
+            logger.info(f"Inserting {len(rank_df)} {rank} nodes...")
+            
+            # Resolve parent keys to the UUIDs returned for earlier ranks and chunks
+            rank_df['parent_id'] = list(map(self.node_ids.get, rank_df.pop('parent_key')))
+            rank_df['rank'] = rank
+            
+            # Omit columns that are empty for the whole rank (e.g. ebird_code above species)
+            rank_df = rank_df.dropna(axis=1, how='all')
+            
+            # Missing values must go out as JSON null, not NaN (pandas may store None as NaN)
+            rank_df = rank_df.astype(object).where(rank_df.notna(), None)
+            
+            rank_batch_size = self.effective_batch_size(rank, len(rank_df), batch_size, concurrency)
+            await self._insert_rank_async(client, rank, rank_df, rank_batch_size, concurrency)
+    
+    @staticmethod
+    def effective_batch_size(rank: str, node_count: int, batch_size: int, concurrency: int) -> int:
+        """Size batches so each rank is split roughly evenly across the concurrent workers"""
+        if rank in SINGLE_BATCH_RANKS:
+            return node_count
+        
+        # batch_size acts as the floor; large ranks grow up to MAX_BATCH_SIZE
+        per_worker = node_count // max(1, concurrency) + 1
+        return min(node_count, max(batch_size, min(per_worker, MAX_BATCH_SIZE)))
+    
+    async def _insert_rank_async(self, client: AsyncClient, rank: str, rank_df: pd.DataFrame,
+                                 batch_size: int, concurrency: int):
+        """Insert one rank's nodes as concurrent batches"""
+        semaphore = asyncio.Semaphore(concurrency)
+        keys = rank_df.pop('key').tolist()
+        batches = [(keys[i:i + batch_size], rank_df.iloc[i:i + batch_size].to_dict('records'))
+                   for i in range(0, len(keys), batch_size)]
+        
+        with tqdm(total=len(batches), desc=f"Inserting {rank} nodes", disable=len(batches) == 1) as pbar:
+            async def insert_batch(batch_num: int, batch_keys: List[str], batch_data: List[Dict]):
                 try:
                     # Insert batch with retry logic
                     max_retries = 3
                     for attempt in range(max_retries):
                         try:
-                            result = self.supabase.table('bird_taxonomy').insert(batch_data).execute()
+                            async with semaphore:
+                                result = await client.table('bird_taxonomy').insert(batch_data).execute()
                             
                             # Store the returned UUIDs for parent-child relationships
-                            for j, (key, node) in enumerate(batch):
-                                if result.data and j < len(result.data):
-                                    self.node_ids[key] = result.data[j]['id']
+                            self.node_ids.update(zip(batch_keys, (row['id'] for row in result.data or [])))
                             
                             break  # Success, exit retry loop
                             
                         except Exception as e:
-                            if attempt == max_retries - 1:
-                                raise  # Last attempt failed
+                            if attempt == max_retries - 1 or not is_transient_error(e):
+                                raise  # Last attempt failed, or retrying cannot help
                             logger.warning(f"Attempt {attempt + 1} failed for {rank} batch: {e}")
-                            time.sleep(2 ** attempt)  # Exponential backoff
+                            await asyncio.sleep(2 ** attempt)  # Exponential backoff, without holding a slot
                     
                 except Exception as e:
-                    error_msg = f"Error inserting {rank} batch {i//batch_size + 1}: {e}"
+                    error_msg = f"Error inserting {rank} batch {batch_num}: {e}"
                     self.stats.errors.append(error_msg)
                     logger.error(error_msg)
-                    continue
+                
+                pbar.update(1)
+            
+            await asyncio.gather(*[insert_batch(n, batch_keys, batch_data)
+                                   for n, (batch_keys, batch_data) in enumerate(batches, 1)])
     
     def generate_summary_report(self) -> str:
         """Generate a comprehensive summary report"""
@@ -446,8 +545,8 @@ class EnhancedeBirdConverter:
         report.append("")
         report.append("NODE BREAKDOWN:")
         
-        for rank in ['class', 'order', 'family', 'genus', 'species']:
-            count = len([n for n in self.nodes.values() if n.rank == rank])
+        for rank in RANKS:
+            count = self.rank_counts[rank]
             report.append(f"  {rank.capitalize()}: {count:,}")
         
         report.append("")
@@ -471,16 +570,15 @@ class EnhancedeBirdConverter:
         
         return "\n".join(report)
     
-    def run_conversion(self, csv_file_path: str, batch_size: int = 50):
+    def run_conversion(self, csv_file_path: str, batch_size: int = 50, concurrency: int = 8):
         """Run the complete conversion process"""
         logger.info("Starting enhanced eBird to Supabase conversion...")
         
         try:
-            # Step 1: Process CSV and build hierarchy
-            self.process_csv_file(csv_file_path)
-            
-            # Step 2: Insert data (if not dry run)
-            if not self.dry_run:
+            # Step 1: Process CSV and build hierarchy, inserting each chunk (if not dry run)
+            if self.dry_run:
+                self.process_csv_file(csv_file_path)
+            else:
                 # Check if table exists
                 try:
                     test_query = self.supabase.table('bird_taxonomy').select('id').limit(1).execute()
@@ -490,9 +588,9 @@ class EnhancedeBirdConverter:
                     logger.error("Please create the table using create_bird_taxonomy_table.sql")
                     return
                 
-                self.insert_nodes_to_supabase(batch_size)
+                self.insert_nodes_to_supabase(csv_file_path, batch_size, concurrency)
             
-            # Step 3: Generate and display report
+            # Step 2: Generate and display report
             report = self.generate_summary_report()
             print(report)
             
@@ -515,7 +613,9 @@ def main():
     parser.add_argument('--csv-path', default='/Users/shuna/aviatlas/data/eBird_taxonomy_v2024.csv',
                        help='Path to eBird CSV file')
     parser.add_argument('--batch-size', type=int, default=50,
-                       help='Batch size for database insertions')
+                       help='Minimum batch size for database insertions (auto-sized per rank)')
+    parser.add_argument('--concurrency', type=int, default=8,
+                       help='Concurrent insert requests per taxonomy rank')
     parser.add_argument('--dry-run', action='store_true',
                        help='Run without making database changes')
     
@@ -526,7 +626,7 @@ def main():
         return
     
     converter = EnhancedeBirdConverter(dry_run=args.dry_run)
-    converter.run_conversion(args.csv_path, args.batch_size)
+    converter.run_conversion(args.csv_path, args.batch_size, args.concurrency)
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
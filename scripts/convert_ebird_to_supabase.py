@@ -7,17 +7,35 @@ suitable for the bird_taxonomy table in Supabase.
 """
 
 import csv
+import io
 import os
-import re
-from typing import Dict, List, Optional, Set
+import sys
+import uuid
+from collections import ChainMap
+from functools import lru_cache
+from operator import itemgetter
+from typing import Dict, Optional
 from dataclasses import dataclass
-from supabase import create_client, Client
+import psycopg2
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-@dataclass
+# Columns loaded with COPY; NULL is written as \N so empty strings stay empty strings
+COPY_COLUMNS = ['id', 'name', 'rank', 'parent_id', 'scientific_name', 'common_name',
+                'ebird_code', 'order_name', 'family_name', 'species_group']
+COPY_NULL = r'\N'
+
+# Spaces and hyphens both become underscores in node keys
+_KEY_TRANS = str.maketrans({' ': '_', '-': '_'})
+
+@lru_cache(maxsize=8192)
+def _node_key(prefix: str, name: str) -> str:
+    """Build the (interned) dedup key for a node; names repeat on most rows, so cache them"""
+    return sys.intern(f"{prefix}_{name.translate(_KEY_TRANS).lower()}")
+
+@dataclass(slots=True)
 class TaxonomyNode:
     """Represents a node in the taxonomy hierarchy"""
     name: str
@@ -32,49 +50,49 @@ class TaxonomyNode:
 
 class eBirdToSupabaseConverter:
     def __init__(self):
-        # Initialize Supabase client
-        supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')  # Use service role key for admin operations
-        
-        if not supabase_url or not supabase_key:
-            raise ValueError("Supabase URL and Service Role Key must be set in environment variables")
+        # Direct Postgres connection string (Supabase dashboard -> Database -> Connection string)
+        self.database_url = os.getenv('SUPABASE_DB_URL')
         
-        self.supabase: Client = create_client(supabase_url, supabase_key)
+        if not self.database_url:
+            raise ValueError("SUPABASE_DB_URL must be set in environment variables")
         
-        # Storage for taxonomy nodes
-        self.nodes: Dict[str, TaxonomyNode] = {}
-        self.node_ids: Dict[str, str] = {}  # Maps node key to UUID
-        
-        # Track processed items to avoid duplicates
-        self.processed_orders: Set[str] = set()
-        self.processed_families: Set[str] = set()
-        self.processed_genera: Set[str] = set()
+        # Storage for taxonomy nodes, one dict per rank (used for both dedup and insertion),
+        # with a combined read-only view over all ranks
+        self.nodes_by_rank: Dict[str, Dict[str, TaxonomyNode]] = {
+            rank: {} for rank in ['class', 'order', 'family', 'genus', 'species']
+        }
+        self.nodes = ChainMap(*self.nodes_by_rank.values())
+        # Maps node key to UUID, generated client-side when the node is created so
+        # parent_id is known without reading rows back
+        self.node_ids: Dict[str, str] = {}
         
     def clean_family_name(self, family_str: str) -> str:
         """Extract clean family name from eBird family string"""
         # Remove parenthetical descriptions like "(Ostriches)"
-        match = re.match(r'^([^(]+)', family_str.strip())
-        return match.group(1).strip() if match else family_str.strip()
+        family_str = family_str.strip()
+        head = family_str.partition('(')[0]
+        return head.strip() if head else family_str
     
     def extract_genus_from_scientific_name(self, sci_name: str) -> Optional[str]:
         """Extract genus from scientific name"""
-        if not sci_name or sci_name.strip() == '':
+        if not sci_name:
             return None
         
         # Handle hybrid names and complex cases
-        if ' x ' in sci_name or '/' in sci_name or '[' in sci_name:
+        sci_name = sci_name.strip()
+        if '/' in sci_name or '[' in sci_name or ' x ' in sci_name:
             return None
         
-        parts = sci_name.strip().split()
-        if len(parts) >= 1:
-            return parts[0]
-        return None
+        # Only the first word is needed; genera repeat heavily, so intern them
+        genus = sci_name.partition(' ')[0]
+        return sys.intern(genus) if genus else None
     
     def create_class_node(self) -> str:
         """Create the root Aves class node"""
         class_key = "class_aves"
-        if class_key not in self.nodes:
-            self.nodes[class_key] = TaxonomyNode(
+        if class_key not in self.nodes_by_rank['class']:
+            self.node_ids[class_key] = str(uuid.uuid4())
+            self.nodes_by_rank['class'][class_key] = TaxonomyNode(
                 name="Aves",
                 rank="class",
                 scientific_name="Aves",
@@ -84,64 +102,65 @@ class eBirdToSupabaseConverter:
     
     def create_order_node(self, order_name: str, class_key: str) -> str:
         """Create an order node"""
-        order_key = f"order_{order_name.lower().replace(' ', '_')}"
-        if order_key not in self.nodes and order_name not in self.processed_orders:
-            self.nodes[order_key] = TaxonomyNode(
+        order_key = _node_key('order', order_name)
+        if order_key not in self.nodes_by_rank['order']:
+            self.node_ids[order_key] = str(uuid.uuid4())
+            self.nodes_by_rank['order'][order_key] = TaxonomyNode(
                 name=order_name,
                 rank="order",
                 scientific_name=order_name,
                 common_name=order_name,
                 parent_id=class_key
             )
-            self.processed_orders.add(order_name)
         return order_key
     
     def create_family_node(self, family_str: str, order_key: str) -> str:
         """Create a family node"""
         family_name = self.clean_family_name(family_str)
-        family_key = f"family_{family_name.lower().replace(' ', '_').replace('-', '_')}"
+        family_key = _node_key('family', family_name)
         
-        if family_key not in self.nodes and family_name not in self.processed_families:
-            self.nodes[family_key] = TaxonomyNode(
+        if family_key not in self.nodes_by_rank['family']:
+            self.node_ids[family_key] = str(uuid.uuid4())
+            self.nodes_by_rank['family'][family_key] = TaxonomyNode(
                 name=family_name,
                 rank="family",
                 scientific_name=family_name,
                 common_name=family_str,  # Keep original with description
                 parent_id=order_key
             )
-            self.processed_families.add(family_name)
         return family_key
     
     def create_genus_node(self, genus_name: str, family_key: str) -> str:
         """Create a genus node"""
-        genus_key = f"genus_{genus_name.lower().replace(' ', '_')}"
-        if genus_key not in self.nodes and genus_name not in self.processed_genera:
-            self.nodes[genus_key] = TaxonomyNode(
+        genus_key = _node_key('genus', genus_name)
+        if genus_key not in self.nodes_by_rank['genus']:
+            self.node_ids[genus_key] = str(uuid.uuid4())
+            self.nodes_by_rank['genus'][genus_key] = TaxonomyNode(
                 name=genus_name,
                 rank="genus",
                 scientific_name=genus_name,
                 common_name=genus_name,
                 parent_id=family_key
             )
-            self.processed_genera.add(genus_name)
         return genus_key
     
-    def create_species_node(self, row: Dict, genus_key: str) -> str:
+    def create_species_node(self, species_code: str, common_name: str, sci_name: str,
+                            order: str, family: str, species_group: str, genus_key: str) -> str:
         """Create a species node"""
-        species_code = row['SPECIES_CODE']
         species_key = f"species_{species_code}"
         
-        if species_key not in self.nodes:
-            self.nodes[species_key] = TaxonomyNode(
-                name=row['PRIMARY_COM_NAME'],
+        if species_key not in self.nodes_by_rank['species']:
+            self.node_ids[species_key] = str(uuid.uuid4())
+            self.nodes_by_rank['species'][species_key] = TaxonomyNode(
+                name=common_name,
                 rank="species",
-                scientific_name=row['SCI_NAME'],
-                common_name=row['PRIMARY_COM_NAME'],
+                scientific_name=sci_name,
+                common_name=common_name,
                 parent_id=genus_key,
                 ebird_code=species_code,
-                order=row['ORDER'],
-                family=row['FAMILY'],
-                species_group=row['SPECIES_GROUP']
+                order=sys.intern(order),  # Shared across all species of the order
+                family=sys.intern(family),
+                species_group=sys.intern(species_group)
             )
         return species_key
     
@@ -152,33 +171,42 @@ class eBirdToSupabaseConverter:
         # Create root class node
         class_key = self.create_class_node()
         
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
+        # newline='' is what the csv module expects; a 1 MiB buffer reads the file in a few calls
+        with open(csv_file_path, 'r', encoding='utf-8', buffering=1 << 20, newline='') as file:
+            reader = csv.reader(file)
+            
+            # Resolve column positions once from the header; one C-level call then pulls all fields
+            header = next(reader)
+            get_fields = itemgetter(*(
+                header.index(col) for col in
+                ('CATEGORY', 'ORDER', 'FAMILY', 'SCI_NAME', 'PRIMARY_COM_NAME', 'SPECIES_CODE', 'SPECIES_GROUP')
+            ))
+            
+            create_order_node = self.create_order_node
+            create_family_node = self.create_family_node
+            create_genus_node = self.create_genus_node
+            create_species_node = self.create_species_node
+            extract_genus = self.extract_genus_from_scientific_name
             
             for i, row in enumerate(reader):
                 if i % 1000 == 0:
                     print(f"Processed {i} rows...")
                 
-                # Skip non-species entries for now (focus on species only)
-                if row['CATEGORY'] != 'species':
-                    continue
+                category, order, family, sci_name, common_name, species_code, species_group = get_fields(row)
                 
-                # Skip if missing essential data
-                if not row['ORDER'] or not row['FAMILY'] or not row['SCI_NAME']:
+                # Skip non-species entries and rows missing essential data
+                if category != 'species' or not order or not family or not sci_name:
                     continue
                 
                 # Create hierarchy: Class -> Order -> Family -> Genus -> Species
-                order_key = self.create_order_node(row['ORDER'], class_key)
-                family_key = self.create_family_node(row['FAMILY'], order_key)
+                order_key = create_order_node(order, class_key)
+                family_key = create_family_node(family, order_key)
                 
-                # Extract genus from scientific name
-                genus_name = self.extract_genus_from_scientific_name(row['SCI_NAME'])
-                if genus_name:
-                    genus_key = self.create_genus_node(genus_name, family_key)
-                    species_key = self.create_species_node(row, genus_key)
-                else:
-                    # If we can't extract genus, attach species directly to family
-                    species_key = self.create_species_node(row, family_key)
+                # Extract genus from scientific name; if we can't, attach species directly to family
+                genus_name = extract_genus(sci_name)
+                parent_key = create_genus_node(genus_name, family_key) if genus_name else family_key
+                create_species_node(species_code, common_name, sci_name, order, family,
+                                    species_group, parent_key)
         
         print(f"Built taxonomy tree with {len(self.nodes)} nodes")
     
@@ -222,55 +250,49 @@ class eBirdToSupabaseConverter:
             print(f"Error creating table: {e}")
     
     def insert_nodes_to_supabase(self):
-        """Insert all taxonomy nodes to Supabase"""
+        """Bulk load all taxonomy nodes into Supabase with a single COPY"""
         print("Inserting nodes to Supabase...")
         
-        # First, insert nodes in hierarchical order (parents before children)
+        copy_sql = (f"COPY bird_taxonomy ({', '.join(COPY_COLUMNS)}) "
+                    f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')")
+        
+        # All ranks go through one COPY, parents before children; the parent_id foreign key
+        # is checked at the end of the statement
         insertion_order = ['class', 'order', 'family', 'genus', 'species']
         
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
         for rank in insertion_order:
-            rank_nodes = [(key, node) for key, node in self.nodes.items() if node.rank == rank]
-            print(f"Inserting {len(rank_nodes)} {rank} nodes...")
+            rank_nodes = self.nodes_by_rank[rank]
+            print(f"Preparing {len(rank_nodes)} {rank} nodes...")
             
-            batch_size = 100
-            for i in range(0, len(rank_nodes), batch_size):
-                batch = rank_nodes[i:i + batch_size]
-                batch_data = []
-                
-                for key, node in batch:
-                    # Resolve parent_id to actual UUID if it exists
-                    parent_uuid = None
-                    if node.parent_id and node.parent_id in self.node_ids:
-                        parent_uuid = self.node_ids[node.parent_id]
-                    
-                    data = {
-                        'name': node.name,
-                        'rank': node.rank,
-                        'parent_id': parent_uuid,
-                        'scientific_name': node.scientific_name,
-                        'common_name': node.common_name,
-                        'ebird_code': node.ebird_code,
-                        'order_name': node.order,
-                        'family_name': node.family,
-                        'species_group': node.species_group
-                    }
-                    batch_data.append(data)
-                
-                try:
-                    # Insert batch
-                    result = self.supabase.table('bird_taxonomy').insert(batch_data).execute()
-                    
-                    # Store the returned UUIDs for parent-child relationships
-                    for j, (key, node) in enumerate(batch):
-                        if result.data and j < len(result.data):
-                            self.node_ids[key] = result.data[j]['id']
-                    
-                    print(f"Inserted batch {i//batch_size + 1} of {rank} nodes")
-                    
-                except Exception as e:
-                    print(f"Error inserting {rank} batch: {e}")
-                    # Continue with next batch
-                    continue
+            for key, node in rank_nodes.items():
+                values = (
+                    self.node_ids[key],
+                    node.name,
+                    node.rank,
+                    self.node_ids.get(node.parent_id),
+                    node.scientific_name,
+                    node.common_name,
+                    node.ebird_code,
+                    node.order,
+                    node.family,
+                    node.species_group
+                )
+                writer.writerow([COPY_NULL if v is None else v for v in values])
+        buffer.seek(0)
+        
+        conn = psycopg2.connect(self.database_url)
+        try:
+            with conn, conn.cursor() as cursor:  # Single transaction, rolled back on error
+                cursor.copy_expert(copy_sql, buffer)
+            
+            print(f"Inserted {len(self.node_ids)} nodes")
+            
+        except psycopg2.Error as e:
+            print(f"Error inserting nodes, nothing was committed: {e}")
+        finally:
+            conn.close()
     
     def run_conversion(self, csv_file_path: str):
         """Run the complete conversion process"""
@@ -39,6 +39,22 @@ CREATE UNIQUE INDEX IF NOT EXISTS idx_bird_taxonomy_ebird_code_unique
     ON bird_taxonomy(ebird_code) 
     WHERE ebird_code IS NOT NULL;
 
+-- Keep updated_at current on every update, so clients don't have to send it
+CREATE OR REPLACE FUNCTION touch_updated_at()
+RETURNS trigger
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS bird_taxonomy_touch_updated_at ON bird_taxonomy;
+CREATE TRIGGER bird_taxonomy_touch_updated_at
+    BEFORE UPDATE ON bird_taxonomy
+    FOR EACH ROW EXECUTE FUNCTION touch_updated_at();
+
 -- Add RLS (Row Level Security) policies if needed
 -- ALTER TABLE bird_taxonomy ENABLE ROW LEVEL SECURITY;
 
@@ -172,6 +188,75 @@ AS $$
     LIMIT 50;
 $$;
 
+-- Create a function to summarize Wikipedia/image coverage of species in one pass
+CREATE OR REPLACE FUNCTION bird_taxonomy_coverage()
+RETURNS TABLE(
+    total_species BIGINT,
+    with_wikipedia BIGINT,
+    with_image BIGINT,
+    with_both BIGINT
+)
+LANGUAGE SQL
+STABLE
+AS $$
+    SELECT 
+        COUNT(*),
+        COUNT(*) FILTER (WHERE wikipedia_url IS NOT NULL),
+        COUNT(*) FILTER (WHERE image_url IS NOT NULL),
+        COUNT(*) FILTER (WHERE wikipedia_url IS NOT NULL AND image_url IS NOT NULL)
+    FROM bird_taxonomy
+    WHERE rank = 'species';
+$$;
+
+-- Create a function returning all database integrity stats in one round trip
+CREATE OR REPLACE FUNCTION validate_taxonomy_stats()
+RETURNS JSONB
+LANGUAGE SQL
+STABLE
+AS $$
+    WITH orphans AS (
+        SELECT id, name, rank
+        FROM bird_taxonomy
+        WHERE parent_id IS NULL AND rank <> 'class'
+    )
+    SELECT jsonb_build_object(
+        'total', COUNT(*),
+        'ranks', (
+            SELECT COALESCE(jsonb_object_agg(rank, rank_count), '{}'::jsonb)
+            FROM (SELECT rank, COUNT(*) AS rank_count FROM bird_taxonomy GROUP BY rank) r
+        ),
+        'orphan_count', (SELECT COUNT(*) FROM orphans),
+        'orphans', (SELECT COALESCE(jsonb_agg(o), '[]'::jsonb) FROM (SELECT * FROM orphans LIMIT 10) o),
+        'duplicate_ebird_codes', (
+            SELECT COUNT(*) FROM (
+                SELECT ebird_code
+                FROM bird_taxonomy
+                WHERE ebird_code IS NOT NULL
+                GROUP BY ebird_code
+                HAVING COUNT(*) > 1
+            ) d
+        )
+    )
+    FROM bird_taxonomy;
+$$;
+
+-- Create a function to bulk-update Wikipedia/image URLs (NULL keeps the existing value)
+CREATE OR REPLACE FUNCTION bulk_update_wiki(ids UUID[], wikis TEXT[], imgs TEXT[])
+RETURNS INTEGER
+LANGUAGE SQL
+AS $$
+    WITH updated AS (
+        UPDATE bird_taxonomy bt
+        SET 
+            wikipedia_url = COALESCE(u.wiki, bt.wikipedia_url),
+            image_url = COALESCE(u.img, bt.image_url)
+        FROM unnest(ids, wikis, imgs) AS u(id, wiki, img)
+        WHERE bt.id = u.id
+        RETURNING 1
+    )
+    SELECT COUNT(*)::INTEGER FROM updated;
+$$;
+
 -- Enable the pg_trgm extension for similarity search (if not already enabled)
 -- CREATE EXTENSION IF NOT EXISTS pg_trgm;
 
@@ -181,4 +266,8 @@ COMMENT ON COLUMN bird_taxonomy.parent_id IS 'Reference to parent node in the ta
 COMMENT ON COLUMN bird_taxonomy.ebird_code IS 'Unique eBird species code for species-level entries';
 COMMENT ON FUNCTION get_taxonomy_descendants(UUID) IS 'Returns all descendant nodes of a given taxonomy node';
 COMMENT ON FUNCTION get_taxonomy_path(UUID) IS 'Returns the full taxonomic path from root to the given node';
-COMMENT ON FUNCTION search_taxonomy(TEXT) IS 'Searches taxonomy by name with similarity scoring';
\ No newline at end of file
+COMMENT ON FUNCTION search_taxonomy(TEXT) IS 'Searches taxonomy by name with similarity scoring';
+COMMENT ON FUNCTION touch_updated_at() IS 'Trigger function that sets updated_at on every update';
+COMMENT ON FUNCTION bulk_update_wiki(UUID[], TEXT[], TEXT[]) IS 'Updates Wikipedia and image URLs for many species in one statement';
+COMMENT ON FUNCTION bird_taxonomy_coverage() IS 'Returns species counts with Wikipedia URLs, image URLs, and both';
+COMMENT ON FUNCTION validate_taxonomy_stats() IS 'Returns total and per-rank counts, orphaned nodes, and duplicate eBird codes as JSON';
@@ -10,10 +10,13 @@ import os
 import sys
 import time
 import json
+import atexit
+import signal
 import logging
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
 from pathlib import Path
-from simple_wiki_update import SimpleWikiUpdater
+from simple_wiki_update import SimpleWikiUpdater, RateLimiter
 
 # Configure logging
 logging.basicConfig(
@@ -26,13 +29,21 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Progress is only rewritten every N batches (plus on exit/Ctrl+C)
+SAVE_PROGRESS_EVERY = 10
+
 class MassWikiUpdater:
     """Mass updater with batch processing and resume capability"""
     
-    def __init__(self, batch_size: int = 100, dry_run: bool = False):
+    def __init__(self, batch_size: int = 100, dry_run: bool = False,
+                 max_workers: int = 10, requests_per_second: float = 5.0):
         self.batch_size = batch_size
         self.dry_run = dry_run
+        self.max_workers = max_workers
         self.updater = SimpleWikiUpdater(dry_run=dry_run)
+        
+        # Lookups run concurrently but are started at a polite, fixed rate
+        self.rate_limiter = RateLimiter(requests_per_second)
         self.progress_file = 'mass_update_progress.json'
         
         # Load or initialize progress
@@ -63,10 +74,15 @@ class MassWikiUpdater:
         try:
             self.progress['last_updated'] = datetime.now().isoformat()
             with open(self.progress_file, 'w') as f:
-                json.dump(self.progress, f, indent=2)
+                json.dump(self.progress, f, separators=(',', ':'))
         except Exception as e:
             logger.error(f"Could not save progress: {e}")
     
+    def _handle_sigint(self, signum, frame):
+        """Save progress before handing Ctrl+C to the default handler"""
+        self._save_progress()
+        signal.default_int_handler(signum, frame)
+    
     def process_all_species(self, max_batches: int = None, start_fresh: bool = False):
         """Process all species in batches"""
         if start_fresh:
@@ -89,6 +105,10 @@ class MassWikiUpdater:
         batch_count = 0
         current_offset = self.progress['last_offset']
         
+        # Make sure progress between periodic saves is not lost
+        atexit.register(self._save_progress)
+        signal.signal(signal.SIGINT, self._handle_sigint)
+        
         while True:
             # Check if we've reached the maximum number of batches
             if max_batches and batch_count >= max_batches:
@@ -124,16 +144,17 @@ class MassWikiUpdater:
             self.progress['total_errors'] += batch_stats['errors']
             self.progress['batches_completed'] += 1
             
-            # Save progress
-            self._save_progress()
+            # Save progress periodically
+            if self.progress['batches_completed'] % SAVE_PROGRESS_EVERY == 0:
+                self._save_progress()
             
             # Log batch summary
-            logger.info(f"\nBatch {batch_count} Summary:")
-            logger.info(f"  Processed: {batch_stats['processed']}")
-            logger.info(f"  Updated: {batch_stats['updated']}")
-            logger.info(f"  Errors: {batch_stats['errors']}")
-            logger.info(f"  Duration: {batch_duration:.1f}s")
-            logger.info(f"  Rate: {batch_stats['processed']/batch_duration:.1f} species/sec")
+            logger.info(
+                f"Batch {batch_count}: processed={batch_stats['processed']} "
+                f"updated={batch_stats['updated']} errors={batch_stats['errors']} "
+                f"wiki={batch_stats['wikipedia_found']} images={batch_stats['images_found']} "
+                f"duration={batch_duration:.1f}s rate={batch_stats['processed']/batch_duration:.1f}/s"
+            )
             
             # Update offset for next batch
             current_offset = self.progress['last_offset']
@@ -143,10 +164,19 @@ class MassWikiUpdater:
                 logger.info("Pausing 2 seconds between batches...")
                 time.sleep(2)
         
+        self._save_progress()
+        atexit.unregister(self._save_progress)
+        signal.signal(signal.SIGINT, signal.default_int_handler)
+        
         self._print_final_summary()
     
+    def _lookup_species(self, species: dict) -> dict:
+        """Rate-limited Wikipedia lookup for one species (runs in a worker thread)"""
+        self.rate_limiter.wait()
+        return self.updater.search_wikipedia(species.get('scientific_name'), species.get('common_name'))
+    
     def _process_batch(self, species_list: list, offset: int) -> dict:
-        """Process a single batch of species"""
+        """Process a single batch of species, looking them up concurrently"""
         stats = {
             'processed': 0,
             'updated': 0,
@@ -154,50 +184,56 @@ class MassWikiUpdater:
             'wikipedia_found': 0,
             'images_found': 0
         }
+        updates = []
         
-        for i, species in enumerate(species_list, 1):
-            stats['processed'] += 1
-            
-            scientific_name = species.get('scientific_name')
-            common_name = species.get('common_name')
-            species_id = species.get('id')
-            
-            logger.info(f"  {offset + i}: {scientific_name}")
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {
+                executor.submit(self._lookup_species, species): (i, species)
+                for i, species in enumerate(species_list, 1)
+            }
             
-            try:
-                # Search for Wikipedia data
-                wiki_result = self.updater.search_wikipedia(scientific_name, common_name)
+            for future in as_completed(futures):
+                i, species = futures[future]
+                stats['processed'] += 1
                 
-                if wiki_result['success']:
-                    if wiki_result['wikipedia_url']:
-                        stats['wikipedia_found'] += 1
-                    if wiki_result['image_url']:
-                        stats['images_found'] += 1
-                    
-                    # Update the database
-                    success = self.updater.update_species(
-                        species_id,
-                        wiki_result['wikipedia_url'],
-                        wiki_result['image_url']
-                    )
+                scientific_name = species.get('scientific_name')
+                species_id = species.get('id')
+                
+                # Per-species detail only with --verbose
+                logger.debug(f"  {offset + i}: {scientific_name}")
+                
+                try:
+                    # Wikipedia data found by the worker
+                    wiki_result = future.result()
                     
-                    if success:
-                        stats['updated'] += 1
-                        logger.info(f"    ✓ Updated")
+                    if wiki_result['success']:
+                        if wiki_result['wikipedia_url']:
+                            stats['wikipedia_found'] += 1
+                        if wiki_result['image_url']:
+                            stats['images_found'] += 1
+                        
+                        # Queue the update; the whole batch is written at once below
+                        updates.append({
+                            'id': species_id,
+                            'wikipedia_url': wiki_result['wikipedia_url'],
+                            'image_url': wiki_result['image_url']
+                        })
                     else:
-                        stats['errors'] += 1
-                        logger.warning(f"    ✗ Update failed")
-                else:
-                    logger.info(f"    - No data found")
-                    if wiki_result.get('error'):
-                        stats['errors'] += 1
-                
-            except Exception as e:
-                logger.error(f"    ✗ Error processing {scientific_name}: {e}")
-                stats['errors'] += 1
-            
-            # Rate limiting
-            time.sleep(0.5)
+                        logger.debug("    - No data found")
+                        if wiki_result.get('error'):
+                            stats['errors'] += 1
+                    
+                except Exception as e:
+                    logger.error(f"    ✗ Error processing {scientific_name}: {e}")
+                    stats['errors'] += 1
+        
+        # Update the database in a single round-trip
+        if updates:
+            updated = self.updater.update_species_batch(updates)
+            stats['updated'] += updated
+            if updated < len(updates):
+                stats['errors'] += len(updates) - updated
+                logger.warning(f"    ✗ Updated {updated}/{len(updates)} species in batch")
         
         return stats
     
@@ -250,6 +286,8 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Run without making database changes')
     parser.add_argument('--batch-size', type=int, default=100, help='Number of species per batch')
     parser.add_argument('--max-batches', type=int, help='Maximum number of batches to process')
+    parser.add_argument('--workers', type=int, default=10, help='Concurrent Wikipedia lookups')
+    parser.add_argument('--rate', type=float, default=5.0, help='Maximum species lookups started per second')
     parser.add_argument('--start-fresh', action='store_true', help='Start fresh (ignore previous progress)')
     parser.add_argument('--status', action='store_true', help='Show current processing status')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
@@ -259,7 +297,12 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
-    updater = MassWikiUpdater(batch_size=args.batch_size, dry_run=args.dry_run)
+    updater = MassWikiUpdater(
+        batch_size=args.batch_size,
+        dry_run=args.dry_run,
+        max_workers=args.workers,
+        requests_per_second=args.rate
+    )
     
     if args.status:
         updater.get_status()
@@ -2,15 +2,23 @@
 """
 Simple Wikipedia and Image URL Updater for Bird Taxonomy
 
-A simplified, more reliable version that updates species one by one
-with proper error handling and logging.
+A simplified, more reliable version that looks species up on a rate-limited
+thread pool and writes results in bulk_update_wiki batches, with proper
+error handling and logging.
 """
 
 import os
 import sys
+import json
+import atexit
 import time
 import logging
+import sqlite3
+import threading
 import requests
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from typing import Optional, Dict, Any
 from urllib.parse import quote
 from supabase import create_client, Client
@@ -30,6 +38,49 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+# Local cache of successful lookups by scientific name, refreshed after this many seconds
+LOOKUP_CACHE_PATH = 'wiki_cache.db'
+LOOKUP_CACHE_TTL = 90 * 86400
+
+# Titles Wikipedia has no article for (404 or disambiguation), re-checked after this many seconds.
+# Kept per title in title_misses, apart from batch_update_wiki_images' per-species misses table.
+MISS_CACHE_TTL = 30 * 86400
+
+# Updates are buffered and written this many species at a time
+UPDATE_BATCH_SIZE = 200
+
+# Keep-alive pool sized for the lookup worker threads; retry server errors. 429s are handled
+# in _get so that every worker backs off, not just the one that was throttled.
+RETRY = Retry(total=5, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504], allowed_methods=["GET"])
+POOL_SIZE = 32
+
+# Throttled (429) requests are retried this many times; without a Retry-After header
+# the pause doubles from THROTTLE_BACKOFF seconds
+THROTTLE_RETRIES = 5
+THROTTLE_BACKOFF = 1.0
+
+# Daemon mode fetches this many species per pass and sleeps this long when there is no work
+DAEMON_BATCH_SIZE = 500
+DAEMON_IDLE_SLEEP = 60
+
+class RateLimiter:
+    """Spaces out calls across threads to at most `rate` per second"""
+    
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self.lock = threading.Lock()
+        self.next_time = 0.0
+    
+    def wait(self):
+        """Block until the caller's slot comes up"""
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        
+        if delay > 0:
+            time.sleep(delay)
+
 class SimpleWikiUpdater:
     """Simple Wikipedia and image URL updater"""
     
@@ -37,10 +88,18 @@ class SimpleWikiUpdater:
         self.dry_run = dry_run
         self.supabase = self._init_supabase()
         self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=RETRY))
         self.session.headers.update({
             'User-Agent': 'AviAtlas/1.0 (Educational) Bird Taxonomy Updater'
         })
         
+        # Earliest time (monotonic) a new Wikipedia request may start; pushed back on 429
+        self.next_allowed = 0.0
+        self.throttle_lock = threading.Lock()
+        
+        # Lookups run on worker threads; their counters are updated under this lock
+        self.stats_lock = threading.Lock()
+        
         # Statistics
         self.stats = {
             'total_processed': 0,
@@ -48,8 +107,72 @@ class SimpleWikiUpdater:
             'images_found': 0,
             'updated': 0,
             'errors': 0,
-            'skipped': 0
+            'skipped': 0,
+            'cached': 0
         }
+        
+        # Updates waiting to be written by _flush_updates
+        self.pending_updates = []
+        
+        # Persistent lookup cache so re-runs skip species already found (in-memory for dry runs).
+        # Shared by the worker threads in mass_wiki_update, hence the lock.
+        self.cache = sqlite3.connect(':memory:' if dry_run else LOOKUP_CACHE_PATH,
+                                     check_same_thread=False, isolation_level=None)
+        self.cache.execute('CREATE TABLE IF NOT EXISTS lookups '
+                           '(scientific_name TEXT PRIMARY KEY, wikipedia_url TEXT, image_url TEXT, fetched_at REAL)')
+        # Summary ETags per page name, so unchanged pages come back as a bodiless 304
+        self.cache.execute('CREATE TABLE IF NOT EXISTS summary_etags '
+                           '(name TEXT PRIMARY KEY, etag TEXT, result TEXT, fetched_at REAL)')
+        self.cache.execute('CREATE TABLE IF NOT EXISTS title_misses (name TEXT PRIMARY KEY, ts REAL)')
+        self.cache_lock = threading.Lock()
+        
+        # Recent misses are checked in memory; new ones are also written through to SQLite
+        self.misses = {
+            row[0] for row in self.cache.execute(
+                'SELECT name FROM title_misses WHERE ts > ?', (time.time() - MISS_CACHE_TTL,)
+            )
+        }
+    
+    def _get_cached_lookup(self, scientific_name: str) -> Optional[Dict[str, Any]]:
+        """Return a cached lookup for scientific_name if it is within the cache TTL"""
+        with self.cache_lock:
+            row = self.cache.execute(
+                'SELECT wikipedia_url, image_url, fetched_at FROM lookups WHERE scientific_name = ?',
+                (scientific_name,)
+            ).fetchone()
+        
+        if row is None or time.time() - row[2] >= LOOKUP_CACHE_TTL:
+            return None
+        return {'wikipedia_url': row[0], 'image_url': row[1]}
+    
+    def _get_summary_etag(self, name: str) -> Optional[tuple]:
+        """Return the (etag, result JSON) stored for name's summary, if any"""
+        with self.cache_lock:
+            return self.cache.execute(
+                'SELECT etag, result FROM summary_etags WHERE name = ?', (name,)
+            ).fetchone()
+    
+    def _store_summary_etag(self, name: str, etag: str, result: Optional[Dict[str, Any]]) -> None:
+        """Remember the ETag and parsed result of name's summary"""
+        with self.cache_lock:
+            self.cache.execute(
+                'INSERT OR REPLACE INTO summary_etags VALUES (?, ?, ?, ?)',
+                (name, etag, json.dumps(result), time.time())
+            )
+    
+    def _record_miss(self, name: str) -> None:
+        """Remember that name had no Wikipedia article"""
+        with self.cache_lock:
+            self.misses.add(name)
+            self.cache.execute('INSERT OR REPLACE INTO title_misses VALUES (?, ?)', (name, time.time()))
+    
+    def _cache_lookup(self, scientific_name: str, wiki_data: Dict[str, Any]) -> None:
+        """Remember a successful lookup"""
+        with self.cache_lock:
+            self.cache.execute(
+                'INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)',
+                (scientific_name, wiki_data.get('wikipedia_url'), wiki_data.get('image_url'), time.time())
+            )
     
     def _init_supabase(self) -> Optional[Client]:
         """Initialize Supabase client"""
@@ -75,63 +198,117 @@ class SimpleWikiUpdater:
         }
         
         try:
-            # Try scientific name first
-            wiki_data = self._get_wikipedia_data(scientific_name)
+            # Reuse a recent result if we already looked this species up
+            wiki_data = self._get_cached_lookup(scientific_name)
             
-            # If not found and we have common name, try that
-            if not wiki_data and common_name:
-                wiki_data = self._get_wikipedia_data(common_name)
+            if wiki_data:
+                with self.stats_lock:
+                    self.stats['cached'] += 1
+            else:
+                # Try scientific name first
+                wiki_data = self._get_wikipedia_data(scientific_name)
+                
+                # If not found and we have common name, try that
+                if not wiki_data and common_name:
+                    wiki_data = self._get_wikipedia_data(common_name)
+                
+                # Only hits are cached; misses may be transient request failures
+                if wiki_data:
+                    self._cache_lookup(scientific_name, wiki_data)
             
             if wiki_data:
                 result.update(wiki_data)
                 result['success'] = True
                 
-                if result['wikipedia_url']:
-                    self.stats['wikipedia_found'] += 1
-                if result['image_url']:
-                    self.stats['images_found'] += 1
+                with self.stats_lock:
+                    if result['wikipedia_url']:
+                        self.stats['wikipedia_found'] += 1
+                    if result['image_url']:
+                        self.stats['images_found'] += 1
             
         except Exception as e:
             result['error'] = str(e)
             logger.error(f"Error searching Wikipedia for {scientific_name}: {e}")
-            self.stats['errors'] += 1
+            with self.stats_lock:
+                self.stats['errors'] += 1
         
         return result
     
+    def _get(self, url: str, **kwargs) -> requests.Response:
+        """GET that honours Wikipedia's Retry-After across all threads"""
+        for attempt in range(THROTTLE_RETRIES + 1):
+            with self.throttle_lock:
+                delay = self.next_allowed - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            
+            response = self.session.get(url, **kwargs)
+            if response.status_code != 429 or attempt == THROTTLE_RETRIES:
+                return response
+            
+            retry_after = response.headers.get('Retry-After')
+            pause = float(retry_after) if retry_after and retry_after.isdigit() else THROTTLE_BACKOFF * 2 ** attempt
+            logger.warning(f"Throttled by Wikipedia, pausing {pause:.1f}s")
+            with self.throttle_lock:
+                self.next_allowed = max(self.next_allowed, time.monotonic() + pause)
+        
+        return response
+    
     def _get_wikipedia_data(self, name: str) -> Optional[Dict[str, Any]]:
         """Get Wikipedia data for a specific name"""
+        # Known to have no article (recent 404 or disambiguation)
+        if name in self.misses:
+            return None
+        
         try:
             # First, try the REST API summary endpoint
             summary_url = f"https://en.wikipedia.org/api/rest_v1/page/summary/{quote(name)}"
             
-            response = self.session.get(summary_url, timeout=15)
+            # Revalidate with the stored ETag; 304 means our previous result still holds
+            cached = self._get_summary_etag(name)
+            headers = {'If-None-Match': cached[0]} if cached else None
+            
+            response = self._get(summary_url, headers=headers, timeout=15)
+            
+            if response.status_code == 304 and cached:
+                return json.loads(cached[1])
             
             if response.status_code == 200:
                 data = response.json()
+                etag = response.headers.get('ETag')
                 
-                # Skip disambiguation pages
+                # Skip disambiguation pages before parsing anything else
                 if data.get('type') == 'disambiguation':
+                    if etag:
+                        self._store_summary_etag(name, etag, None)
+                    self._record_miss(name)
                     return None
                 
-                result = {
-                    'wikipedia_url': data.get('content_urls', {}).get('desktop', {}).get('page'),
-                    'image_url': None
-                }
+                # The summary schema is fixed, so index it directly
+                try:
+                    wikipedia_url = data['content_urls']['desktop']['page']
+                except KeyError:
+                    wikipedia_url = None
                 
                 # Get image from thumbnail or original
-                if 'thumbnail' in data:
-                    result['image_url'] = data['thumbnail'].get('source')
-                elif 'originalimage' in data:
-                    result['image_url'] = data['originalimage'].get('source')
+                image = data.get('thumbnail') or data.get('originalimage')
+                
+                result = {
+                    'wikipedia_url': wikipedia_url,
+                    'image_url': image.get('source') if image else None
+                }
                 
                 # If we have a Wikipedia URL but no image, try to get one
                 if result['wikipedia_url'] and not result['image_url']:
                     result['image_url'] = self._get_page_image(name)
                 
+                if etag:
+                    self._store_summary_etag(name, etag, result)
                 return result
             
             elif response.status_code == 404:
                 # Page not found, this is normal
+                self._record_miss(name)
                 return None
             
             else:
@@ -161,7 +338,7 @@ class SimpleWikiUpdater:
                 'pilimit': 1
             }
             
-            response = self.session.get(api_url, params=params, timeout=10)
+            response = self._get(api_url, params=params, timeout=10)
             
             if response.status_code == 200:
                 data = response.json()
@@ -176,8 +353,8 @@ class SimpleWikiUpdater:
         
         return None
     
-    def get_species_to_update(self, limit: int = None, offset: int = 0) -> list:
-        """Get species that need Wikipedia/image updates"""
+    def get_species_to_update(self, limit: int = None, offset: int = 0, after_id: str = None) -> list:
+        """Get species that need Wikipedia/image updates, optionally only those with id > after_id"""
         if self.dry_run:
             return [
                 {
@@ -195,7 +372,10 @@ class SimpleWikiUpdater:
         try:
             query = self.supabase.table('bird_taxonomy').select(
                 'id, scientific_name, common_name, wikipedia_url, image_url'
-            ).eq('rank', 'species').is_('wikipedia_url', 'null')
+            ).eq('rank', 'species').is_('wikipedia_url', 'null').order('id')
+            
+            if after_id is not None:
+                query = query.gt('id', after_id)
             
             if limit:
                 query = query.limit(limit)
@@ -210,96 +390,141 @@ class SimpleWikiUpdater:
             logger.error(f"Error fetching species: {e}")
             return []
     
-    def update_species(self, species_id: str, wikipedia_url: str = None, image_url: str = None) -> bool:
-        """Update a single species with Wikipedia and/or image URL"""
+    def update_species_batch(self, updates: list) -> int:
+        """Update many species in one round-trip via the bulk_update_wiki RPC"""
+        updates = [u for u in updates if u.get('wikipedia_url') or u.get('image_url')]
+        if not updates:
+            return 0
+        
         if self.dry_run:
-            logger.info(f"[DRY RUN] Would update {species_id}:")
-            if wikipedia_url:
-                logger.info(f"  Wikipedia: {wikipedia_url}")
-            if image_url:
-                logger.info(f"  Image: {image_url}")
-            return True
+            logger.info(f"[DRY RUN] Would update {len(updates)} species")
+            for update in updates[:3]:  # Show first 3 as examples
+                logger.info(f"  {update['id']}: Wiki={bool(update.get('wikipedia_url'))}, Image={bool(update.get('image_url'))}")
+            return len(updates)
         
         try:
-            update_data = {}
+            # NULLs keep the existing values on the server side
+            response = self.supabase.rpc('bulk_update_wiki', {
+                'ids': [update['id'] for update in updates],
+                'wikis': [update.get('wikipedia_url') for update in updates],
+                'imgs': [update.get('image_url') for update in updates]
+            }).execute()
             
-            if wikipedia_url:
-                update_data['wikipedia_url'] = wikipedia_url
+            updated_count = response.data or 0
+            self.stats['updated'] += updated_count
+            return updated_count
             
-            if image_url:
-                update_data['image_url'] = image_url
-            
-            if update_data:
-                update_data['updated_at'] = 'now()'
-                
-                response = self.supabase.table('bird_taxonomy').update(
-                    update_data
-                ).eq('id', species_id).execute()
-                
-                if response.data:
-                    self.stats['updated'] += 1
-                    return True
-                else:
-                    logger.warning(f"No data returned for update of {species_id}")
-                    return False
-            else:
-                logger.debug(f"No updates needed for {species_id}")
-                return True
-                
         except Exception as e:
-            logger.error(f"Error updating {species_id}: {e}")
-            self.stats['errors'] += 1
-            return False
+            logger.error(f"Error updating species batch: {e}")
+            self.stats['errors'] += len(updates)
+            return 0
     
-    def process_species(self, limit: int = None, start_offset: int = 0) -> None:
-        """Process species to add Wikipedia and image URLs"""
+    def _flush_updates(self) -> None:
+        """Write all buffered updates in one bulk_update_wiki call"""
+        if not self.pending_updates:
+            return
+        
+        updates, self.pending_updates = self.pending_updates, []
+        updated = self.update_species_batch(updates)
+        logger.info(f"✓ Updated {updated}/{len(updates)} species")
+    
+    def process_species(self, limit: int = None, start_offset: int = 0,
+                        max_workers: int = POOL_SIZE, requests_per_second: float = 20.0,
+                        after_id: str = None) -> Optional[str]:
+        """Process species to add Wikipedia and image URLs; returns the last species id fetched"""
         logger.info(f"Starting Wikipedia/image update (dry_run={self.dry_run})")
         
-        species_list = self.get_species_to_update(limit, start_offset)
+        species_list = self.get_species_to_update(limit, start_offset, after_id)
         total_species = len(species_list)
         
         if total_species == 0:
             logger.info("No species found that need updates")
-            return
+            return None
         
         logger.info(f"Found {total_species} species to process")
         
-        for i, species in enumerate(species_list, 1):
-            self.stats['total_processed'] += 1
-            
-            scientific_name = species.get('scientific_name')
-            common_name = species.get('common_name')
-            species_id = species.get('id')
-            
-            logger.info(f"Processing {i}/{total_species}: {scientific_name}")
-            
-            # Search for Wikipedia data
-            wiki_result = self.search_wikipedia(scientific_name, common_name)
-            
-            if wiki_result['success']:
-                # Update the database
-                success = self.update_species(
-                    species_id,
-                    wiki_result['wikipedia_url'],
-                    wiki_result['image_url']
-                )
+        # Rate limiting - be respectful to Wikipedia; lookups start at a fixed pace across all workers
+        rate_limiter = RateLimiter(requests_per_second)
+        
+        # Hoist lookups out of the result loop; counters are folded into stats at the end
+        log_info = logger.info
+        processed = skipped = 0
+        
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self._process_one, species, rate_limiter): species
+                    for species in species_list
+                }
                 
-                if success:
-                    logger.info(f"✓ Updated {scientific_name}")
-                else:
-                    logger.warning(f"✗ Failed to update {scientific_name}")
-            else:
-                logger.info(f"- No Wikipedia data found for {scientific_name}")
-                self.stats['skipped'] += 1
-            
-            # Rate limiting - be respectful to Wikipedia
-            time.sleep(0.5)
+                for processed, future in enumerate(as_completed(futures), 1):
+                    species = futures[future]
+                    wiki_result = future.result()
+                    
+                    if wiki_result['success']:
+                        # Queue the database update
+                        self.pending_updates.append({
+                            'id': species.get('id'),
+                            'wikipedia_url': wiki_result['wikipedia_url'],
+                            'image_url': wiki_result['image_url']
+                        })
+                        if len(self.pending_updates) >= UPDATE_BATCH_SIZE:
+                            self._flush_updates()
+                    else:
+                        log_info(f"- No Wikipedia data found for {species.get('scientific_name')}")
+                        skipped += 1
+                    
+                    # Progress update every 25 species
+                    if processed % 25 == 0:
+                        self._print_progress(processed, total_species)
+        finally:
+            stats = self.stats
+            stats['total_processed'] += processed
+            stats['skipped'] += skipped
             
-            # Progress update every 25 species
-            if i % 25 == 0:
-                self._print_progress(i, total_species)
+            # Don't lose lookups already made if the run stops early
+            self._flush_updates()
         
         self._print_final_stats()
+        return species_list[-1]['id']
+    
+    def run_daemon(self, batch_size: int = DAEMON_BATCH_SIZE, max_workers: int = POOL_SIZE,
+                   requests_per_second: float = 20.0) -> None:
+        """Keep processing species until interrupted, reusing one warm HTTP session"""
+        atexit.register(self.session.close)
+        logger.info(f"Starting daemon mode (batch_size={batch_size})")
+        
+        # Keyset pagination: species that are still missing a Wikipedia URL after a pass stay
+        # in the query, so seek past the last id seen; a sweep restarts after the idle sleep
+        last_id = None
+        
+        try:
+            while True:
+                last_id = self.process_species(
+                    limit=batch_size,
+                    max_workers=max_workers,
+                    requests_per_second=requests_per_second,
+                    after_id=last_id
+                )
+                
+                # Dry runs always return the same sample rows
+                if self.dry_run:
+                    return
+                
+                if last_id is None:
+                    logger.info(f"No work, sleeping {DAEMON_IDLE_SLEEP}s")
+                    time.sleep(DAEMON_IDLE_SLEEP)
+        except KeyboardInterrupt:
+            logger.info("Daemon stopped")
+    
+    def _process_one(self, species: Dict[str, Any], rate_limiter: RateLimiter) -> Dict[str, Any]:
+        """Look up a single species (runs in a worker thread)"""
+        scientific_name = species.get('scientific_name')
+        logger.debug(f"Processing {scientific_name}")
+        
+        rate_limiter.wait()
+        # Search for Wikipedia data
+        return self.search_wikipedia(scientific_name, species.get('common_name'))
     
     def _print_progress(self, current: int, total: int) -> None:
         """Print progress update"""
@@ -318,6 +543,7 @@ class SimpleWikiUpdater:
         logger.info(f"Successfully updated: {self.stats['updated']}")
         logger.info(f"Errors: {self.stats['errors']}")
         logger.info(f"Skipped (no data found): {self.stats['skipped']}")
+        logger.info(f"Served from cache: {self.stats['cached']}")
         
         if self.stats['total_processed'] > 0:
             success_rate = (self.stats['updated'] / self.stats['total_processed']) * 100
@@ -333,6 +559,10 @@ def main():
     parser.add_argument('--dry-run', action='store_true', help='Run without making database changes')
     parser.add_argument('--limit', type=int, help='Limit number of species to process')
     parser.add_argument('--offset', type=int, default=0, help='Starting offset for processing')
+    parser.add_argument('--workers', type=int, default=POOL_SIZE, help='Concurrent Wikipedia lookups')
+    parser.add_argument('--rate', type=float, default=20.0, help='Maximum species lookups started per second')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Keep running, processing new species as they appear (--limit sets the batch size)')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
@@ -341,7 +571,21 @@ def main():
         logging.getLogger().setLevel(logging.DEBUG)
     
     updater = SimpleWikiUpdater(dry_run=args.dry_run)
-    updater.process_species(limit=args.limit, start_offset=args.offset)
+    
+    if args.daemon:
+        updater.run_daemon(
+            batch_size=args.limit or DAEMON_BATCH_SIZE,
+            max_workers=args.workers,
+            requests_per_second=args.rate
+        )
+        return
+    
+    updater.process_species(
+        limit=args.limit,
+        start_offset=args.offset,
+        max_workers=args.workers,
+        requests_per_second=args.rate
+    )
 
 if __name__ == '__main__':
     main()
\ No newline at end of file
@@ -10,10 +10,11 @@ import os
 import sys
 import time
 import logging
-import requests
-from typing import Optional, Dict, Any, List
+import asyncio
+import sqlite3
+import aiohttp
+from typing import Optional, Dict, Any, List, Iterator
 from dataclasses import dataclass
-from urllib.parse import quote
 import json
 from supabase import create_client, Client
 from dotenv import load_dotenv
@@ -32,29 +33,54 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@dataclass
+# Local cache of successful lookups by scientific name (shared with simple_wiki_update),
+# refreshed after this many seconds
+LOOKUP_CACHE_PATH = 'wiki_cache.db'
+LOOKUP_CACHE_TTL = 90 * 86400
+
+# Species are fetched from Supabase this many rows per request
+SPECIES_PAGE_SIZE = 1000
+
+# Updates are buffered and written this many species at a time
+UPDATE_BATCH_SIZE = 200
+
+# Maximum number of titles the MediaWiki Action API accepts per query
+TITLES_PER_REQUEST = 50
+
+# Each species sends its scientific and common name in the same query
+SPECIES_PER_REQUEST = TITLES_PER_REQUEST // 2
+
+# Throttling and server errors are retried with exponential backoff (or the server's Retry-After)
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+MAX_RETRIES = 5
+RETRY_BACKOFF = 0.3
+
+@dataclass(slots=True, frozen=True)
 class WikiImageData:
     """Data structure for Wikipedia and image information"""
     wikipedia_url: Optional[str] = None
     image_url: Optional[str] = None
-    description: Optional[str] = None
     success: bool = False
     error: Optional[str] = None
 
 class WikiImageUpdater:
     """Updates bird taxonomy with Wikipedia URLs and images"""
     
-    def __init__(self, dry_run: bool = False):
+    def __init__(self, dry_run: bool = False, max_concurrent_requests: int = 32,
+                 requests_per_second: float = 20.0):
         self.dry_run = dry_run
         self.supabase = self._init_supabase()
-        self.session = requests.Session()
-        self.session.headers.update({
+        self.headers = {
             'User-Agent': 'AviAtlas/1.0 (https://github.com/your-repo) Bird Taxonomy Updater'
-        })
+        }
+        
+        # Concurrency limit for in-flight requests (created inside the event loop)
+        self.max_concurrent_requests = max_concurrent_requests
+        self.semaphore: Optional[asyncio.Semaphore] = None
         
-        # Rate limiting
-        self.request_delay = 0.5  # seconds between requests
-        self.last_request_time = 0
+        # Rate limiting: requests start at most every request_delay seconds
+        self.request_delay = 1.0 / requests_per_second
+        self.next_request_time = 0.0
         
         # Statistics
         self.stats = {
@@ -62,8 +88,35 @@ class WikiImageUpdater:
             'wikipedia_found': 0,
             'images_found': 0,
             'errors': 0,
-            'skipped': 0
+            'skipped': 0,
+            'cached': 0
         }
+        
+        # Updates waiting to be written by _flush_updates
+        self.pending_updates = []
+        
+        # Persistent lookup cache so re-runs skip species already found (in-memory for dry runs)
+        self.cache = sqlite3.connect(':memory:' if dry_run else LOOKUP_CACHE_PATH, isolation_level=None)
+        self.cache.execute('CREATE TABLE IF NOT EXISTS lookups '
+                           '(scientific_name TEXT PRIMARY KEY, wikipedia_url TEXT, image_url TEXT, fetched_at REAL)')
+    
+    def _get_cached_lookup(self, scientific_name: str) -> Optional[Dict[str, Any]]:
+        """Return a cached lookup for scientific_name if it is within the cache TTL"""
+        row = self.cache.execute(
+            'SELECT wikipedia_url, image_url, fetched_at FROM lookups WHERE scientific_name = ?',
+            (scientific_name,)
+        ).fetchone()
+        
+        if row is None or time.time() - row[2] >= LOOKUP_CACHE_TTL:
+            return None
+        return {'url': row[0], 'image': row[1]}
+    
+    def _cache_lookup(self, scientific_name: str, wiki_data: Dict[str, Any]) -> None:
+        """Remember a successful lookup"""
+        self.cache.execute(
+            'INSERT OR REPLACE INTO lookups VALUES (?, ?, ?, ?)',
+            (scientific_name, wiki_data.get('url'), wiki_data.get('image'), time.time())
+        )
     
     def _init_supabase(self) -> Client:
         """Initialize Supabase client"""
@@ -79,157 +132,154 @@ class WikiImageUpdater:
         
         return create_client(url, key)
     
-    def _rate_limit(self):
-        """Implement rate limiting for API requests"""
-        current_time = time.time()
-        time_since_last = current_time - self.last_request_time
-        if time_since_last < self.request_delay:
-            time.sleep(self.request_delay - time_since_last)
-        self.last_request_time = time.time()
+    async def _rate_limit(self):
+        """Wait for this request's slot; slots are handed out every request_delay seconds"""
+        # No lock needed: the slot is claimed before the first await
+        now = time.monotonic()
+        delay = self.next_request_time - now
+        self.next_request_time = max(now, self.next_request_time) + self.request_delay
+        if delay > 0:
+            await asyncio.sleep(delay)
+    
+    async def _get_json(self, session: aiohttp.ClientSession, url: str, params: dict = None) -> Dict[str, Any]:
+        """Rate-limited GET returning the decoded JSON body; raises once retries are exhausted"""
+        for attempt in range(MAX_RETRIES + 1):
+            retry_after = None
+            await self._rate_limit()
+            
+            try:
+                async with self.semaphore:
+                    async with session.get(url, params=params) as response:
+                        if response.status == 200:
+                            return await response.json()
+                        if response.status not in RETRY_STATUSES or attempt == MAX_RETRIES:
+                            # Surface the failure so callers count it as an error, not as missing pages
+                            raise aiohttp.ClientResponseError(
+                                response.request_info, response.history,
+                                status=response.status, message=response.reason
+                            )
+                        retry_after = response.headers.get('Retry-After')
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError):
+                if attempt == MAX_RETRIES:
+                    raise
+            
+            # Back off outside the semaphore so other requests keep going
+            delay = float(retry_after) if retry_after and retry_after.isdigit() else RETRY_BACKOFF * 2 ** attempt
+            await asyncio.sleep(delay)
     
-    def search_wikipedia(self, scientific_name: str, common_name: str = None) -> WikiImageData:
-        """Search for Wikipedia page and extract information"""
-        result = WikiImageData()
+    async def search_wikipedia(self, session: aiohttp.ClientSession, species_list: List[Dict[str, Any]]) -> List[WikiImageData]:
+        """Search for Wikipedia pages for up to SPECIES_PER_REQUEST species at once
+        
+        Scientific and common names are resolved together in one query, preferring the
+        scientific name's page. Results are returned in input order.
+        """
+        found: List[Optional[Dict[str, Any]]] = [None] * len(species_list)
+        error = None
+        
+        # Reuse recent results for species we already looked up
+        pending = []
+        for i, species in enumerate(species_list):
+            found[i] = self._get_cached_lookup(species.get('scientific_name'))
+            if found[i]:
+                self.stats['cached'] += 1
+            else:
+                pending.append(i)
         
         try:
-            # Try scientific name first
-            wiki_data = self._search_wikipedia_by_name(scientific_name)
-            
-            # If not found and we have common name, try that
-            if not wiki_data and common_name:
-                wiki_data = self._search_wikipedia_by_name(common_name)
+            if pending:
+                # Look both names up at once instead of retrying misses by common name
+                names = []
+                for i in pending:
+                    names.append(species_list[i].get('scientific_name'))
+                    names.append(species_list[i].get('common_name'))
+                by_name = await self._batch_lookup(session, [name for name in names if name])
+                
+                # Prefer the scientific name's page
+                for i in pending:
+                    found[i] = (by_name.get(species_list[i].get('scientific_name'))
+                                or by_name.get(species_list[i].get('common_name')))
+                
+                # Only hits are cached; misses may be transient request failures
+                for i in pending:
+                    if found[i]:
+                        self._cache_lookup(species_list[i]['scientific_name'], found[i])
             
+        except Exception as e:
+            logger.error(f"Error searching Wikipedia for {len(species_list)} species: {e}")
+            error = str(e)
+            self.stats['errors'] += len(pending)
+        
+        # Build each (immutable) result once
+        results = []
+        for wiki_data in found:
             if wiki_data:
-                result.wikipedia_url = wiki_data.get('url')
-                result.image_url = wiki_data.get('image')
-                result.description = wiki_data.get('description')
-                result.success = True
+                result = WikiImageData(
+                    wikipedia_url=wiki_data.get('url'),
+                    image_url=wiki_data.get('image'),
+                    success=True
+                )
                 
                 if result.wikipedia_url:
                     self.stats['wikipedia_found'] += 1
                 if result.image_url:
                     self.stats['images_found'] += 1
+            else:
+                result = WikiImageData(error=error)
             
-        except Exception as e:
-            result.error = str(e)
-            logger.error(f"Error searching Wikipedia for {scientific_name}: {e}")
-            self.stats['errors'] += 1
-        
-        return result
-    
-    def _search_wikipedia_by_name(self, name: str) -> Optional[Dict[str, Any]]:
-        """Search Wikipedia for a specific name"""
-        self._rate_limit()
-        
-        # First, search for the page
-        search_url = "https://en.wikipedia.org/api/rest_v1/page/summary/" + quote(name)
-        
-        try:
-            response = self.session.get(search_url, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                
-                # Check if it's a disambiguation page or not found
-                if data.get('type') == 'disambiguation':
-                    return None
-                
-                result = {
-                    'url': data.get('content_urls', {}).get('desktop', {}).get('page'),
-                    'description': data.get('extract'),
-                    'image': None
-                }
-                
-                # Try to get the main image
-                if 'thumbnail' in data:
-                    result['image'] = data['thumbnail'].get('source')
-                elif 'originalimage' in data:
-                    result['image'] = data['originalimage'].get('source')
-                
-                # If no image from summary, try to get from page content
-                if not result['image'] and result['url']:
-                    result['image'] = self._get_wikipedia_image(name)
-                
-                return result
-                
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Request failed for {name}: {e}")
+            results.append(result)
         
-        return None
+        return results
     
-    def _get_wikipedia_image(self, page_title: str) -> Optional[str]:
-        """Get the main image from a Wikipedia page"""
-        self._rate_limit()
+    async def _batch_lookup(self, session: aiohttp.ClientSession, names: List[str]) -> Dict[str, Optional[Dict[str, Any]]]:
+        """Resolve up to TITLES_PER_REQUEST names (page URL and image) in one MediaWiki query"""
+        names = list(dict.fromkeys(names))
+        if not names:
+            return {}
         
-        try:
-            # Use Wikipedia API to get page images
-            api_url = "https://en.wikipedia.org/w/api.php"
-            params = {
-                'action': 'query',
-                'format': 'json',
-                'titles': page_title,
-                'prop': 'pageimages',
-                'pithumbsize': 500,
-                'pilimit': 1
-            }
-            
-            response = self.session.get(api_url, params=params, timeout=10)
-            
-            if response.status_code == 200:
-                data = response.json()
-                pages = data.get('query', {}).get('pages', {})
-                
-                for page_id, page_data in pages.items():
-                    if 'thumbnail' in page_data:
-                        return page_data['thumbnail']['source']
-                    elif 'pageimage' in page_data:
-                        # Get full image URL
-                        image_title = page_data['pageimage']
-                        return self._get_commons_image_url(image_title)
+        api_url = "https://en.wikipedia.org/w/api.php"
+        params = {
+            'action': 'query',
+            'format': 'json',
+            'titles': '|'.join(names),
+            'prop': 'pageimages|info|pageprops',
+            'inprop': 'url',
+            'ppprop': 'disambiguation',
+            'pithumbsize': 500,
+            'pilimit': TITLES_PER_REQUEST,
+            'redirects': 1
+        }
         
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Failed to get image for {page_title}: {e}")
+        data = await self._get_json(session, api_url, params)
         
-        return None
-    
-    def _get_commons_image_url(self, filename: str) -> Optional[str]:
-        """Get direct URL for Wikimedia Commons image"""
-        self._rate_limit()
+        query = data.get('query', {})
+        normalized = {item['from']: item['to'] for item in query.get('normalized', [])}
+        redirects = {item['from']: item['to'] for item in query.get('redirects', [])}
+        pages_by_title = {page['title']: page for page in query.get('pages', {}).values() if 'title' in page}
         
-        try:
-            api_url = "https://commons.wikimedia.org/w/api.php"
-            params = {
-                'action': 'query',
-                'format': 'json',
-                'titles': f'File:{filename}',
-                'prop': 'imageinfo',
-                'iiprop': 'url',
-                'iiurlwidth': 500
-            }
-            
-            response = self.session.get(api_url, params=params, timeout=10)
+        results = {}
+        for name in names:
+            # Follow MediaWiki's title normalization and redirects back to the requested name
+            title = normalized.get(name, name)
+            title = redirects.get(title, title)
+            page_data = pages_by_title.get(title)
             
-            if response.status_code == 200:
-                data = response.json()
-                pages = data.get('query', {}).get('pages', {})
-                
-                for page_data in pages.values():
-                    imageinfo = page_data.get('imageinfo', [])
-                    if imageinfo and 'thumburl' in imageinfo[0]:
-                        return imageinfo[0]['thumburl']
-                    elif imageinfo and 'url' in imageinfo[0]:
-                        return imageinfo[0]['url']
-        
-        except requests.exceptions.RequestException as e:
-            logger.warning(f"Failed to get Commons image URL for {filename}: {e}")
+            # Skip missing pages and disambiguation pages
+            if (page_data is None or 'missing' in page_data or 'invalid' in page_data
+                    or 'disambiguation' in page_data.get('pageprops', {})):
+                results[name] = None
+            else:
+                results[name] = {
+                    'url': page_data.get('fullurl'),
+                    'image': page_data.get('thumbnail', {}).get('source')
+                }
         
-        return None
+        return results
     
-    def get_species_to_update(self, limit: int = None) -> List[Dict[str, Any]]:
-        """Get species that need Wikipedia/image updates"""
+    def iter_species_to_update(self, limit: int = None, page_size: int = SPECIES_PAGE_SIZE) -> Iterator[List[Dict[str, Any]]]:
+        """Yield pages of species that are missing a Wikipedia URL or an image URL"""
         if self.dry_run:
             # Return sample data for dry run
-            return [
+            yield [
                 {
                     'id': 'sample-1',
                     'scientific_name': 'Corvus corax',
@@ -242,108 +292,145 @@ class WikiImageUpdater:
                     'common_name': 'House Sparrow',
                     'rank': 'species'
                 }
-            ]
+            ][:limit]
+            return
         
-        try:
-            query = self.supabase.table('bird_taxonomy').select(
-                'id, scientific_name, common_name, rank, wikipedia_url, image_url'
-            ).eq('rank', 'species').is_('wikipedia_url', 'null')
+        last_id = None
+        remaining = limit
+        
+        while remaining is None or remaining > 0:
+            try:
+                # Keyset pagination: rows drop out of the filter as they are updated,
+                # so seek past the last seen id instead of using an offset
+                query = self.supabase.table('bird_taxonomy').select(
+                    'id, scientific_name, common_name, rank'
+                ).eq('rank', 'species').or_('wikipedia_url.is.null,image_url.is.null')
+                
+                if last_id is not None:
+                    query = query.gt('id', last_id)
+                
+                count = page_size if remaining is None else min(page_size, remaining)
+                page = query.order('id').limit(count).execute().data
+                
+            except Exception as e:
+                logger.error(f"Error fetching species data: {e}")
+                return
             
-            if limit:
-                query = query.limit(limit)
+            if not page:
+                return
             
-            response = query.execute()
-            return response.data
+            yield page
             
-        except Exception as e:
-            logger.error(f"Error fetching species data: {e}")
-            return []
+            last_id = page[-1]['id']
+            if remaining is not None:
+                remaining -= len(page)
     
-    def update_species_data(self, species_id: str, wiki_data: WikiImageData) -> bool:
-        """Update species with Wikipedia and image data"""
+    def update_species_batch(self, updates: List[Dict[str, Any]]) -> int:
+        """Update many species in one round-trip via the bulk_update_wiki RPC"""
         if self.dry_run:
-            logger.info(f"[DRY RUN] Would update species {species_id} with:")
-            logger.info(f"  Wikipedia URL: {wiki_data.wikipedia_url}")
-            logger.info(f"  Image URL: {wiki_data.image_url}")
-            return True
+            logger.info(f"[DRY RUN] Would update {len(updates)} species")
+            for update in updates[:3]:  # Show first 3 as examples
+                logger.info(f"  {update['id']}: Wiki={bool(update.get('wikipedia_url'))}, Image={bool(update.get('image_url'))}")
+            return len(updates)
         
         try:
-            update_data = {}
-            
-            if wiki_data.wikipedia_url:
-                update_data['wikipedia_url'] = wiki_data.wikipedia_url
+            # NULLs keep the existing values on the server side
+            response = self.supabase.rpc('bulk_update_wiki', {
+                'ids': [update['id'] for update in updates],
+                'wikis': [update.get('wikipedia_url') for update in updates],
+                'imgs': [update.get('image_url') for update in updates]
+            }).execute()
             
-            if wiki_data.image_url:
-                update_data['image_url'] = wiki_data.image_url
+            updated_count = response.data or 0
+            logger.info(f"Updated {updated_count} species in batch")
+            return updated_count
             
-            if update_data:
-                update_data['updated_at'] = 'now()'
-                
-                response = self.supabase.table('bird_taxonomy').update(
-                    update_data
-                ).eq('id', species_id).execute()
-                
-                if response.data:
-                    logger.info(f"Updated species {species_id}")
-                    return True
-                else:
-                    logger.warning(f"No data returned for species {species_id} update")
-                    return False
-            else:
-                logger.info(f"No updates needed for species {species_id}")
-                return True
-                
         except Exception as e:
-            logger.error(f"Error updating species {species_id}: {e}")
-            self.stats['errors'] += 1
-            return False
+            logger.error(f"Error updating species batch: {e}")
+            self.stats['errors'] += len(updates)
+            return 0
+    
+    async def _flush_updates(self) -> None:
+        """Write all buffered updates without blocking the event loop"""
+        if not self.pending_updates:
+            return
+        
+        updates, self.pending_updates = self.pending_updates, []
+        await asyncio.to_thread(self.update_species_batch, updates)
     
     def process_species(self, limit: int = None) -> None:
         """Process species to add Wikipedia and image URLs"""
+        asyncio.run(self._process_species_async(limit))
+    
+    async def _process_species_async(self, limit: int = None) -> None:
+        """Look species up concurrently on a single shared HTTP session"""
         logger.info(f"Starting Wikipedia and image update process (dry_run={self.dry_run})")
         
-        species_list = self.get_species_to_update(limit)
-        total_species = len(species_list)
+        self.semaphore = asyncio.Semaphore(self.max_concurrent_requests)
+        pages = self.iter_species_to_update(limit)
+        processed = 0
         
-        logger.info(f"Found {total_species} species to process")
+        # Keep-alive pool sized to the concurrency limit
+        async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrent_requests, ttl_dns_cache=300),
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=10)
+        ) as session:
+            try:
+                species_list = await asyncio.to_thread(next, pages, None)
+                
+                while species_list:
+                    logger.info(f"Found {len(species_list)} species to process")
+                    
+                    # Fetch the next page from Supabase while this one is looked up
+                    next_page = asyncio.create_task(asyncio.to_thread(next, pages, None))
+                    
+                    # One MediaWiki query resolves a whole window of species
+                    tasks = [
+                        self._process_window(session, species_list[i:i + SPECIES_PER_REQUEST])
+                        for i in range(0, len(species_list), SPECIES_PER_REQUEST)
+                    ]
+                    for task in asyncio.as_completed(tasks):
+                        processed += await task
+                        
+                        if len(self.pending_updates) >= UPDATE_BATCH_SIZE:
+                            await self._flush_updates()
+                        
+                        self._print_progress(processed)
+                    
+                    species_list = await next_page
+            finally:
+                # Don't lose lookups already made if the run stops early
+                await self._flush_updates()
         
-        for i, species in enumerate(species_list, 1):
-            self.stats['total_processed'] += 1
-            
-            scientific_name = species.get('scientific_name')
-            common_name = species.get('common_name')
-            species_id = species.get('id')
-            
-            logger.info(f"Processing {i}/{total_species}: {scientific_name}")
-            
-            # Skip if already has both URLs
-            if species.get('wikipedia_url') and species.get('image_url'):
-                logger.info(f"Skipping {scientific_name} - already has URLs")
-                self.stats['skipped'] += 1
-                continue
-            
-            # Search for Wikipedia data
-            wiki_data = self.search_wikipedia(scientific_name, common_name)
-            
+        self._print_final_stats()
+    
+    async def _process_window(self, session: aiohttp.ClientSession, window: List[Dict[str, Any]]) -> int:
+        """Look up a window of species and queue their URLs; returns the number processed"""
+        self.stats['total_processed'] += len(window)
+        
+        # Species that already have both URLs are filtered out by the query
+        results = await self.search_wikipedia(session, window)
+        
+        for species, wiki_data in zip(window, results):
             if wiki_data.success:
-                # Update the database
-                success = self.update_species_data(species_id, wiki_data)
-                if not success:
-                    self.stats['errors'] += 1
-            else:
-                logger.warning(f"No Wikipedia data found for {scientific_name}")
+                # Queue the database update; only species with something to write
+                if wiki_data.wikipedia_url or wiki_data.image_url:
+                    self.pending_updates.append({
+                        'id': species.get('id'),
+                        'wikipedia_url': wiki_data.wikipedia_url,
+                        'image_url': wiki_data.image_url
+                    })
+            elif not wiki_data.error:
+                # Failed lookups were already counted as errors in search_wikipedia
+                logger.warning(f"No Wikipedia data found for {species.get('scientific_name')}")
                 self.stats['skipped'] += 1
-            
-            # Progress update every 50 species
-            if i % 50 == 0:
-                self._print_progress(i, total_species)
         
-        self._print_final_stats()
+        return len(window)
     
-    def _print_progress(self, current: int, total: int) -> None:
+    def _print_progress(self, current: int) -> None:
         """Print progress update"""
-        percentage = (current / total) * 100
-        logger.info(f"Progress: {current}/{total} ({percentage:.1f}%)")
+        logger.info(f"Progress: {current} species processed")
         logger.info(f"Stats: Wiki={self.stats['wikipedia_found']}, Images={self.stats['images_found']}, Errors={self.stats['errors']}")
     
     def _print_final_stats(self) -> None:
@@ -356,6 +443,7 @@ class WikiImageUpdater:
         logger.info(f"Image URLs found: {self.stats['images_found']}")
         logger.info(f"Errors: {self.stats['errors']}")
         logger.info(f"Skipped: {self.stats['skipped']}")
+        logger.info(f"Served from cache: {self.stats['cached']}")
         logger.info("="*60)
 
 def main():
@@ -365,6 +453,8 @@ def main():
     parser = argparse.ArgumentParser(description='Update bird taxonomy with Wikipedia URLs and images')
     parser.add_argument('--dry-run', action='store_true', help='Run without making database changes')
     parser.add_argument('--limit', type=int, help='Limit number of species to process')
+    parser.add_argument('--concurrency', type=int, default=32, help='Maximum concurrent Wikipedia requests')
+    parser.add_argument('--rate', type=float, default=20.0, help='Maximum Wikipedia requests started per second')
     parser.add_argument('--verbose', '-v', action='store_true', help='Enable verbose logging')
     
     args = parser.parse_args()
@@ -372,7 +462,11 @@ def main():
     if args.verbose:
         logging.getLogger().setLevel(logging.DEBUG)
     
-    updater = WikiImageUpdater(dry_run=args.dry_run)
+    updater = WikiImageUpdater(
+        dry_run=args.dry_run,
+        max_concurrent_requests=args.concurrency,
+        requests_per_second=args.rate
+    )
     updater.process_species(limit=args.limit)
 
 if __name__ == '__main__':
@@ -6,30 +6,58 @@ This script provides validation functions and test cases for the bird taxonomy c
 """
 
 import os
-import csv
-from typing import Dict, List, Set, Tuple
+import re
+from functools import lru_cache
+from typing import Dict, List, Optional, Set, Tuple
 from collections import defaultdict, Counter
+import pandas as pd
 from supabase import create_client, Client
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
+# CSV columns the validator needs
+REQUIRED_COLUMNS = frozenset({'TAXON_ORDER', 'CATEGORY', 'SPECIES_CODE', 'PRIMARY_COM_NAME',
+                              'SCI_NAME', 'ORDER', 'FAMILY', 'SPECIES_GROUP'})
+
+# Rows parsed per chunk during CSV validation; keeps memory bounded to one chunk
+CSV_CHUNK_SIZE = 50000
+
+# Valid if it contains a hybrid/complex marker anywhere, or starts with a capitalized genus
+_VALID_SCI_NAME_RE = re.compile(r'.*[x/\[(]|[A-Z]')
+# Hybrids and slashes have no single genus
+_GENUS_SKIP_RE = re.compile(r' x |/')
+
+@lru_cache(maxsize=None)
+def _get_supabase_client() -> Optional[Client]:
+    """Create the Supabase client once per process so validators share its connection pool"""
+    supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
+    supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+    
+    if supabase_url and supabase_key:
+        return create_client(supabase_url, supabase_key)
+    return None
+
 class TaxonomyValidator:
     def __init__(self):
         # Initialize Supabase client
-        supabase_url = os.getenv('NEXT_PUBLIC_SUPABASE_URL')
-        supabase_key = os.getenv('SUPABASE_SERVICE_ROLE_KEY')
+        self.supabase = _get_supabase_client()
         
-        if supabase_url and supabase_key:
-            self.supabase: Client = create_client(supabase_url, supabase_key)
-        else:
-            self.supabase = None
+        if self.supabase is None:
             print("Warning: Supabase credentials not found. Database validation will be skipped.")
     
     def validate_csv_structure(self, csv_file_path: str) -> Dict[str, any]:
         """Validate the structure and content of the eBird CSV file"""
-        print("Validating CSV structure...")
+        return self._validate_all(csv_file_path)[0]
+    
+    def validate_hierarchy_consistency(self, csv_file_path: str) -> Dict[str, any]:
+        """Validate that the taxonomic hierarchy is consistent"""
+        return self._validate_all(csv_file_path)[1]
+    
+    def _validate_all(self, csv_file_path: str) -> Tuple[Dict[str, any], Dict[str, any]]:
+        """Run the CSV structure and hierarchy checks in a single pass over the file"""
+        print("Validating CSV structure and hierarchy consistency...")
         
         validation_results = {
             'total_rows': 0,
@@ -38,132 +66,117 @@ class TaxonomyValidator:
             'categories': Counter(),
             'orders': set(),
             'families': set(),
-            'duplicate_codes': [],
+            'duplicate_codes': set(),
             'invalid_scientific_names': [],
             'errors': []
         }
         
+        order_to_families = defaultdict(set)
+        genera = set()
+        family_to_orders = defaultdict(set)
+        inconsistencies = []
+        
         seen_codes = set()
         
         try:
-            with open(csv_file_path, 'r', encoding='utf-8') as file:
-                reader = csv.DictReader(file)
-                
-                # Check required columns
-                required_columns = ['TAXON_ORDER', 'CATEGORY', 'SPECIES_CODE', 'PRIMARY_COM_NAME', 
-                                  'SCI_NAME', 'ORDER', 'FAMILY', 'SPECIES_GROUP']
-                missing_columns = [col for col in required_columns if col not in reader.fieldnames]
-                
-                if missing_columns:
-                    validation_results['errors'].append(f"Missing required columns: {missing_columns}")
-                    return validation_results
-                
-                for i, row in enumerate(reader):
-                    validation_results['total_rows'] += 1
-                    
-                    # Count categories
-                    validation_results['categories'][row['CATEGORY']] += 1
-                    
-                    if row['CATEGORY'] == 'species':
-                        validation_results['species_count'] += 1
-                    
-                    # Check for missing essential data
-                    for field in ['SPECIES_CODE', 'PRIMARY_COM_NAME', 'SCI_NAME']:
-                        if not row[field].strip():
-                            validation_results['missing_data'][field] += 1
+            # Check required columns
+            header = pd.read_csv(csv_file_path, nrows=0, encoding='utf-8').columns
+            missing_columns = sorted(REQUIRED_COLUMNS.difference(header))
+            
+            # The structure checks need every required column; the hierarchy walk still runs
+            check_structure = not missing_columns
+            if missing_columns:
+                validation_results['errors'].append(f"Missing required columns: {missing_columns}")
+            
+            reader = pd.read_csv(csv_file_path, usecols=lambda col: col in REQUIRED_COLUMNS, dtype=str,
+                                 keep_default_na=False, encoding='utf-8', chunksize=CSV_CHUNK_SIZE)
+            
+            with reader:
+                for chunk in reader:
+                    category = chunk['CATEGORY']
+                    order = chunk['ORDER']
+                    family = chunk['FAMILY']
+                    # Stripped once per chunk and shared by every check below
+                    sci_name = chunk['SCI_NAME'].str.strip()
                     
-                    # Check for duplicate species codes
-                    code = row['SPECIES_CODE']
-                    if code in seen_codes:
-                        validation_results['duplicate_codes'].append(code)
-                    else:
-                        seen_codes.add(code)
+                    if check_structure:
+                        validation_results['total_rows'] += len(chunk)
+                        
+                        # Count categories (in order of first appearance)
+                        validation_results['categories'].update(category.value_counts(sort=False).to_dict())
+                        
+                        validation_results['species_count'] += int(category.eq('species').sum())
+                        
+                        # Check for missing essential data
+                        missing = {
+                            'SPECIES_CODE': chunk['SPECIES_CODE'].str.strip().eq(''),
+                            'PRIMARY_COM_NAME': chunk['PRIMARY_COM_NAME'].str.strip().eq(''),
+                            'SCI_NAME': sci_name.eq('')
+                        }
+                        for field, mask in missing.items():
+                            count = int(mask.sum())
+                            if count:
+                                validation_results['missing_data'][field] += count
+                        
+                        # Check for duplicate species codes, within this chunk and against earlier ones
+                        # (each duplicate recorded once)
+                        codes = chunk['SPECIES_CODE']
+                        chunk_codes = set(codes)
+                        validation_results['duplicate_codes'] |= set(codes[codes.duplicated()])
+                        validation_results['duplicate_codes'] |= chunk_codes & seen_codes
+                        seen_codes |= chunk_codes
+                        
+                        # Validate scientific name format
+                        named = sci_name[~missing['SCI_NAME']]
+                        invalid = named[~self._valid_scientific_names(named)]
+                        validation_results['invalid_scientific_names'].extend(invalid.tolist())
+                        
+                        # Collect taxonomy data
+                        validation_results['orders'] |= set(order[order.ne('')].unique())
+                        validation_results['families'] |= set(family[family.ne('')].unique())
                     
-                    # Validate scientific name format
-                    sci_name = row['SCI_NAME'].strip()
-                    if sci_name and not self._is_valid_scientific_name(sci_name):
-                        validation_results['invalid_scientific_names'].append(sci_name)
+                    # Hierarchy is built from species rows only
+                    is_species = category.eq('species')
+                    species_order = order[is_species]
+                    species_family = family[is_species]
+                    species_sci_name = sci_name[is_species]
+                    has_family = species_family.ne('')
                     
-                    # Collect taxonomy data
-                    if row['ORDER']:
-                        validation_results['orders'].add(row['ORDER'])
-                    if row['FAMILY']:
-                        validation_results['families'].add(row['FAMILY'])
+                    links = pd.DataFrame({'order': species_order, 'family': species_family})
+                    links = links[species_order.ne('') & has_family].drop_duplicates()
+                    for order_name, family_name in zip(links['order'], links['family']):
+                        order_to_families[order_name].add(family_name)
+                        family_to_orders[family_name].add(order_name)
                     
-                    # Progress indicator
-                    if i % 5000 == 0:
-                        print(f"Validated {i} rows...")
+                    # Genus is the first word of the scientific name
+                    genus = species_sci_name.str.split(n=1).str[0]
+                    usable = has_family & species_sci_name.ne('') & ~species_sci_name.str.contains(_GENUS_SKIP_RE)
+                    genera |= set(genus[usable].unique())
+            
+            if check_structure:
+                print(f"Validated {validation_results['total_rows']} rows")
         
         except Exception as e:
             validation_results['errors'].append(f"Error reading CSV: {str(e)}")
         
-        return validation_results
-    
-    def _is_valid_scientific_name(self, sci_name: str) -> bool:
-        """Basic validation for scientific name format"""
-        # Skip hybrid names and complex cases
-        if any(char in sci_name for char in ['x', '/', '[', '(']):
-            return True  # These are valid but complex cases
-        
-        # Basic binomial nomenclature check
-        parts = sci_name.split()
-        if len(parts) < 1:
-            return False
-        
-        # First part should be capitalized (genus)
-        if not parts[0][0].isupper():
-            return False
-        
-        return True
-    
-    def validate_hierarchy_consistency(self, csv_file_path: str) -> Dict[str, any]:
-        """Validate that the taxonomic hierarchy is consistent"""
-        print("Validating hierarchy consistency...")
-        
-        hierarchy_data = defaultdict(lambda: defaultdict(set))
-        inconsistencies = []
-        
-        with open(csv_file_path, 'r', encoding='utf-8') as file:
-            reader = csv.DictReader(file)
-            
-            for row in reader:
-                if row['CATEGORY'] != 'species':
-                    continue
-                
-                order = row['ORDER']
-                family = row['FAMILY']
-                genus = self._extract_genus(row['SCI_NAME'])
-                
-                if order and family:
-                    hierarchy_data[order]['families'].add(family)
-                
-                if family and genus:
-                    hierarchy_data[family]['genera'].add(genus)
-        
         # Check for families appearing in multiple orders
-        family_to_orders = defaultdict(set)
-        for order, data in hierarchy_data.items():
-            for family in data['families']:
-                family_to_orders[family].add(order)
-        
         for family, orders in family_to_orders.items():
             if len(orders) > 1:
                 inconsistencies.append(f"Family '{family}' appears in multiple orders: {list(orders)}")
         
-        return {
-            'total_orders': len(hierarchy_data),
+        hierarchy_results = {
+            'total_orders': len(order_to_families),
             'total_families': len(family_to_orders),
             'inconsistencies': inconsistencies,
-            'hierarchy_stats': dict(hierarchy_data)
+            'total_genera': len(genera)
         }
-    
-    def _extract_genus(self, sci_name: str) -> str:
-        """Extract genus from scientific name"""
-        if not sci_name or ' x ' in sci_name or '/' in sci_name:
-            return None
         
-        parts = sci_name.strip().split()
-        return parts[0] if parts else None
+        return validation_results, hierarchy_results
+    
+    def _valid_scientific_names(self, sci_names: pd.Series) -> pd.Series:
+        """Basic validation for scientific name format over a column of stripped names"""
+        # Hybrid names and complex cases are valid; otherwise the genus must be capitalized
+        return sci_names.str.match(_VALID_SCI_NAME_RE).astype(bool)
     
     def validate_database_integrity(self) -> Dict[str, any]:
         """Validate the integrity of data in Supabase"""
@@ -173,32 +186,20 @@ class TaxonomyValidator:
         print("Validating database integrity...")
         
         try:
-            # Check table exists and get basic stats
-            result = self.supabase.table('bird_taxonomy').select('rank', count='exact').execute()
-            total_count = result.count
-            
-            # Get counts by rank
-            rank_counts = {}
-            for rank in ['class', 'order', 'family', 'genus', 'species']:
-                result = self.supabase.table('bird_taxonomy').select('id', count='exact').eq('rank', rank).execute()
-                rank_counts[rank] = result.count
-            
-            # Check for orphaned records (except class level)
-            orphaned_query = self.supabase.table('bird_taxonomy').select('id', 'name', 'rank').is_('parent_id', 'null').neq('rank', 'class').execute()
-            orphaned_records = orphaned_query.data
+            # All counts, a sample of orphaned records (except class level) and the
+            # duplicate ebird_code check come back from one RPC
+            stats = self.supabase.rpc('validate_taxonomy_stats').execute().data
             
             # Check for circular references (basic check)
             # This is a simplified check - in production you'd want more comprehensive validation
             
-            # Check for duplicate ebird_codes
-            duplicate_codes_query = self.supabase.rpc('check_duplicate_ebird_codes').execute()
-            
             return {
-                'total_records': total_count,
-                'rank_distribution': rank_counts,
-                'orphaned_records': len(orphaned_records),
-                'orphaned_details': orphaned_records[:10],  # First 10 for review
-                'validation_passed': len(orphaned_records) == 0
+                'total_records': stats['total'],
+                'rank_distribution': stats['ranks'],
+                'orphaned_records': stats['orphan_count'],
+                'orphaned_details': stats['orphans'],  # First 10 for review
+                'duplicate_codes': stats['duplicate_ebird_codes'],
+                'validation_passed': stats['orphan_count'] == 0 and stats['duplicate_ebird_codes'] == 0
             }
         
         except Exception as e:
@@ -224,9 +225,12 @@ class TaxonomyValidator:
         """Run all validation checks"""
         print("=== Running Comprehensive Validation ===")
         
+        # Both CSV checks share one read of the file
+        csv_validation, hierarchy_validation = self._validate_all(csv_file_path)
+        
         results = {
-            'csv_validation': self.validate_csv_structure(csv_file_path),
-            'hierarchy_validation': self.validate_hierarchy_consistency(csv_file_path),
+            'csv_validation': csv_validation,
+            'hierarchy_validation': hierarchy_validation,
             'database_validation': self.validate_database_integrity(),
             'sample_queries': self.generate_sample_queries()
         }
@@ -261,6 +265,7 @@ class TaxonomyValidator:
         print(f"\n🌳 HIERARCHY VALIDATION:")
         print(f"  Total orders: {hierarchy_results['total_orders']}")
         print(f"  Total families: {hierarchy_results['total_families']}")
+        print(f"  Total genera: {hierarchy_results['total_genera']}")
         
         if hierarchy_results['inconsistencies']:
             print(f"  ❌ Inconsistencies: {len(hierarchy_results['inconsistencies'])}")
@@ -278,6 +283,7 @@ class TaxonomyValidator:
             print(f"  Total records: {db_results['total_records']:,}")
             print(f"  Rank distribution: {db_results['rank_distribution']}")
             print(f"  Orphaned records: {db_results['orphaned_records']}")
+            print(f"  Duplicate eBird codes: {db_results['duplicate_codes']}")
             
             if db_results['validation_passed']:
                 print(f"  ✅ Database integrity check passed")
@@ -303,10 +309,11 @@ def main():
     validator.print_validation_report(results)
     
     # Save sample queries to file
+    content = "-- Sample Queries for Bird Taxonomy Database\n\n" + "".join(
+        f"-- Query {i}\n{query}\n\n" for i, query in enumerate(results['sample_queries'], 1)
+    )
     with open('/Users/shuna/aviatlas/scripts/sample_queries.sql', 'w') as f:
-        f.write("-- Sample Queries for Bird Taxonomy Database\n\n")
-        for i, query in enumerate(results['sample_queries'], 1):
-            f.write(f"-- Query {i}\n{query}\n\n")
+        f.write(content)
     
     print("\n📝 Sample queries saved to scripts/sample_queries.sql")
 